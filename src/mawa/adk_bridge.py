@@ -1,110 +1,239 @@
 import ast
+import asyncio
+import functools
+import logging
 import time
-from google.adk.events import Event, EventActions
-from google.adk.sessions import InMemorySessionService, Session, State
+from collections import Counter
+from typing import Optional
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, State
 from google.adk.runners import Runner
 from google.genai import types
-import uuid
-from .agent import _create_style_extraction_agent, create_main_agent
-from .cache import store_to_cache, key_to_hash, clear_from_cache, get_from_cache, is_cached
-from .constants import ROOT_PROMPT, STYLING_INSTRUCTIONS, CURRENT_PROMPT_HASH
-from .utils import _maybe_extract_component_id_from_prompt
+from .admission import INTERACTIVE_PRIORITY, request_priority
+from .agent import _create_style_extraction_agent, agent_fingerprint, create_main_agent, create_routed_agent
+from .cache import CACHE_MISS, STYLE_NAMESPACE, USER_NAMESPACE, key_to_hash, store_version_to_cache, \
+    store_user_version_to_cache, get_version_or_miss, \
+    get_version_or_stale, clear_version_from_cache, mark_version_stale
+from .callbacks import StreamingResponseCleaner, pending_cache_key, pending_cache_version, pending_styling_instructions
+from .component_templates import COMPONENT_TEMPLATES, render_template
+from .constants import COMPONENT_STORED_AT_PREFIX, ROOT_PROMPT, STYLING_INSTRUCTIONS, CURRENT_PROMPT_HASH
+from .data_access import load_data_directly, save_match_directly
+from .metrics import register_collector, sessions as sessions_metric, user_state as user_state_metric
+from .request_classifier import CACHE, COMPONENT_PAGE_AGENT, DATA_LOADER_AGENT, DATA_SAVER_AGENT, MAIN_PAGE_AGENT, \
+    classify_request
+from .revalidation import STALE_WHILE_REVALIDATE, revalidate
+from .sessions import EphemeralSessions, create_session_service
+from .single_flight import single_flight, single_flight_stream
+from .utils import _cache_namespace_of_prompt, _maybe_extract_component_id_from_prompt
 
 APP_NAME = "Table Football App"
 
-main_agent_session_service = InMemorySessionService()
+logger = logging.getLogger(__name__)
+
+# the state of the users (e.g. their components) must be the same in all the workers
+main_agent_session_service = create_session_service()
 
 style_extraction_service = InMemorySessionService()
 
+# each request gets its own session, deleted as soon as the request is done
+main_agent_sessions = EphemeralSessions(main_agent_session_service, APP_NAME)
 
-async def _store_styling_info_to_state(instructions: str, session: Session):
-    """
-       Stores the detailed styling instructions extracted from user description to the state.
+style_extraction_sessions = EphemeralSessions(style_extraction_service, APP_NAME)
 
-       Args:
-           instructions: The instructions extracted by a different agent
-           session: The session to which the event should be added to
-       """
+# cache key -> the number of the edits of it being generated
+_edits_in_progress: Counter[str] = Counter()
 
-    current_time = time.time()
-    state_changes = {
-        f"{STYLING_INSTRUCTIONS}": instructions
-    }
-    actions_with_update = EventActions(state_delta=state_changes)
-    system_event = Event(
-        invocation_id="styling_instructions_update",
-        author="system",
-        actions=actions_with_update,
-        timestamp=current_time
+ROUTED_AGENT_NAMES = [MAIN_PAGE_AGENT, COMPONENT_PAGE_AGENT, DATA_LOADER_AGENT, DATA_SAVER_AGENT]
+
+# the styling of the requests which do not generate any HTML, or which do not belong to any page
+NO_STYLING_INSTRUCTIONS = "No specific styling provided by the user."
+
+# the version of the list of the components edited by a user, it is not generated so it never changes
+EDITED_COMPONENTS_VERSION = "1"
+
+
+# The agents and runners hold no per-request state (it all lives in the sessions),
+# so they are built only once per process and shared by all the requests.
+@functools.cache
+def _get_main_agent_runner() -> Runner:
+    return Runner(
+        agent=create_main_agent(),
+        app_name=APP_NAME,
+        session_service=main_agent_session_service
     )
-    await main_agent_session_service.append_event(session, system_event)
 
 
-async def _store_hashed_prompt_to_state(prompt: str, session: Session):
+@functools.cache
+def _get_routed_agent_runner(agent_name: str) -> Runner:
+    return Runner(
+        agent=create_routed_agent(agent_name),
+        app_name=APP_NAME,
+        session_service=main_agent_session_service
+    )
+
+
+@functools.cache
+def _get_style_extraction_runner() -> Runner:
+    return Runner(
+        agent=_create_style_extraction_agent(),
+        app_name=APP_NAME,
+        session_service=style_extraction_service
+    )
+
+
+@functools.cache
+def _get_routed_agent_fingerprint(agent_name: str) -> str:
+    return agent_fingerprint(_get_routed_agent_runner(agent_name).agent)
+
+
+@functools.cache
+def _get_style_extraction_fingerprint() -> str:
+    return agent_fingerprint(_get_style_extraction_runner().agent)
+
+
+async def _resolve_cache_version(prompt, styling_instructions) -> str:
+    """
+       The version of the cached page or component. It changes whenever the agents generating it
+       or the styling change, so that only the affected entries get regenerated.
+       """
+    is_component = _maybe_extract_component_id_from_prompt(prompt) != prompt
+    agent_name = COMPONENT_PAGE_AGENT if is_component else MAIN_PAGE_AGENT
+    return key_to_hash(_get_routed_agent_fingerprint(agent_name) + key_to_hash(await styling_instructions))
+
+
+def build_runners():
     """
-       Stores the hash of the prompt to session state so that the agents can access it.
+    Builds all the agents and runners upfront so that the first requests do not have to pay for it.
+    """
+    _get_main_agent_runner()
+    _get_style_extraction_runner()
+    for agent_name in ROUTED_AGENT_NAMES:
+        _get_routed_agent_runner(agent_name)
+
+
+def _hashed_prompt_state(prompt: str) -> dict:
+    """
+       The hash of the prompt for the session state so that the agents can access it.
        It is meant to be used for cache invalidation
 
        Args:
            prompt: The string to be processed and stored.
-           session: The session to which the event should be added to
        """
-
-    current_time = time.time()
-    state_changes = {
+    return {
         f"{CURRENT_PROMPT_HASH}": key_to_hash(prompt)
     }
-    actions_with_update = EventActions(state_delta=state_changes)
-    system_event = Event(
-        invocation_id="prompt_hash_update",
-        author="system",
-        actions=actions_with_update,
-        timestamp=current_time
-    )
-    await main_agent_session_service.append_event(session, system_event)
 
 
-async def _maybe_store_custom_component_prompt(prompt: str, session: Session):
+def _root_prompt_state(root_prompt: str) -> dict:
+    """
+       The prompt of the page the request belongs to for the session state, e.g. for the load_from_cache.
+       """
+    return {
+        ROOT_PROMPT: root_prompt
+    }
+
+
+def _cache_decision_state(classification) -> dict:
     """
-       Processes an input string. If the string is a JSON object with an 'id' and 'prompt'
-       property, stores the prompt under the user:id in the state.
+       The cache decision of a request classified without the cache_decision_agent for the session state,
+       stored the same way the cache_decision_agent would do it.
+
+       Args:
+           classification: The result of the classify_request, or None if the request has not been classified
+       """
+    if classification is None:
+        return {}
+    return {
+        "cache_decision_agent_output": classification.cache_decision
+    }
+
+
+def _custom_component_prompt_state(prompt: str) -> dict:
+    """
+       Processes an input string. If the string is a JSON object of an edit with an 'id' and 'prompt'
+       property, returns the prompt under the user:id for the session state.
        The id in this case refers to the id of the UI component this prompt is used to generate.
+       The time it is stored at is stored along, see the filter_component_keys.
 
-        If the input string is not a json, it just returns it as is and does not store anything.
+        If the input string is not a json or not an edit, nothing is stored. The user state is kept as long as
+        the session service runs, so the prompts of the components the user has not edited are not stored,
+        the page prompt generates them the same way for all the users.
        Args:
            prompt: The string to be processed.
-           session: The session to which the event should be added to
        """
     try:
         data = ast.literal_eval(prompt)
 
-        if isinstance(data, dict) and 'id' in data and 'prompt' in data:
-            current_time = time.time()
-            state_changes = {
-                f"{State.USER_PREFIX}{data['id']}": data['prompt']
+        if isinstance(data, dict) and 'id' in data and 'prompt' in data and 'invalidate_cache_key' in data:
+            return {
+                f"{State.USER_PREFIX}{data['id']}": data['prompt'],
+                f"{State.USER_PREFIX}{COMPONENT_STORED_AT_PREFIX}{data['id']}": time.time()
             }
-            actions_with_update = EventActions(state_delta=state_changes)
-            system_event = Event(
-                invocation_id="component_prompt_update",
-                author="system",
-                actions=actions_with_update,
-                timestamp=current_time
-            )
-            await main_agent_session_service.append_event(session, system_event)
-            return data['prompt']
         else:
-            return prompt
+            return {}
     except (ValueError, SyntaxError, TypeError):
-        return prompt
+        return {}
 
-def _maybe_invalidate_cache(cache_key, prompt: str):
+
+def _is_edit(prompt: str) -> bool:
+    """
+       Whether the prompt is an edit of a page/component (contains the 'invalidate_cache_key').
+       """
     try:
         data = ast.literal_eval(prompt)
-        if isinstance(data, dict) and 'invalidate_cache_key' in data:
-            clear_from_cache(cache_key)
+        return isinstance(data, dict) and 'invalidate_cache_key' in data
     except (ValueError, SyntaxError, TypeError):
         # it is an OK state if the prompt can not be parsed
-        pass
+        return False
+
+
+def _invalidate_cache(cache_key, prompt: str):
+    """
+       Invalidates the cached page/component edited by the prompt.
+       With the STALE_WHILE_REVALIDATE, the value is only marked stale, so that the other visitors keep getting it
+       until the edit generates the new one.
+       """
+    if STALE_WHILE_REVALIDATE:
+        mark_version_stale(cache_key, _cache_namespace_of_prompt(prompt))
+    else:
+        clear_version_from_cache(cache_key, _cache_namespace_of_prompt(prompt))
+
+
+def _resolve_cache_key(user_id, prompt: str, root_prompt: str, is_edit: bool) -> tuple[str, Optional[str]]:
+    """
+       The key the page/component is cached under. The components the user has edited are cached only for the user,
+       and so are the pages of such a user, since the prompts of the edited components are part of the page prompt
+       (see the inject_stored_component_ids). Everything else is shared by all the users.
+
+       Returns:
+           The cache key and the id of the user owning the cached value, None if it is shared.
+       """
+    component_id = _maybe_extract_component_id_from_prompt(prompt)
+    is_component = component_id != prompt
+    edited_components = _get_edited_components(user_id)
+    if is_edit and is_component and component_id not in edited_components:
+        edited_components = edited_components + [component_id]
+        # accounted to the USER_CACHE_QUOTA along with the values cached for the user
+        store_user_version_to_cache(user_id, _edited_components_key(user_id), EDITED_COMPONENTS_VERSION,
+                                    edited_components, USER_NAMESPACE)
+
+    # this combination is used to make sure that different styling of the component will be cached separately
+    cache_key = root_prompt + component_id
+    is_user_specific = component_id in edited_components if is_component else bool(edited_components)
+    if is_user_specific:
+        return f"user {user_id}: {cache_key}", user_id
+    return cache_key, None
+
+
+def _get_edited_components(user_id) -> list[str]:
+    edited_components = get_version_or_miss(_edited_components_key(user_id), EDITED_COMPONENTS_VERSION,
+                                            USER_NAMESPACE)
+    return [] if edited_components is CACHE_MISS else edited_components
+
+
+def _edited_components_key(user_id) -> str:
+    return f"components edited by the user {user_id}"
 
 
 def _is_cache_hit(event: Event) -> bool:
@@ -112,85 +241,297 @@ def _is_cache_hit(event: Event) -> bool:
         event.custom_metadata['cache_response'] == True
 
 
-async def _wait_for_result(runner, user_id, session_id, prompt, additional_event_condition=None):
+async def _stream_result(runner, user_id, session_id, prompt, additional_event_condition=None, streamed_authors=()):
+    """
+       Runs the agent, with the partial responses enabled if there are any streamed_authors.
+       The final response is the first one passing the additional_event_condition, if any.
+
+       Yields:
+           (text, True) for each partial response of the streamed_authors as it is generated
+           and finally (text, False) with the complete final response.
+       """
     content = types.Content(role='user', parts=[types.Part(text=prompt)])
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE if streamed_authors else StreamingMode.NONE)
 
-    final_response_text = "No specific styling provided by the user."
+    final_response_text = NO_STYLING_INSTRUCTIONS
     async for event in runner.run_async(user_id=user_id, session_id=session_id,
-                                        new_message=content):
-        is_final = event.is_final_response()
-        if additional_event_condition:
-            is_final = is_final and additional_event_condition(event)
-
-        if is_final:
+                                        new_message=content, run_config=run_config):
+        if event.partial:
+            if event.author in streamed_authors and event.content and event.content.parts:
+                for part in event.content.parts:
+                    if part.text and not part.thought:
+                        yield part.text, True
+            continue
+
+        if not event.content and not (event.actions and event.actions.escalate):
+            # e.g. the state changes done by the callbacks
+            continue
+
+        if event.is_final_response() and (additional_event_condition is None or additional_event_condition(event)):
             if event.content and event.content.parts:
                 final_response_text = event.content.parts[0].text
             elif event.actions and event.actions.escalate:
                 final_response_text = f"Agent escalated: {event.error_message or 'No specific message.'}"
             break
-    return final_response_text
+    yield final_response_text, False
 
 
-async def run_root_agent(user_id, prompt, styling_instructions):
-    root_prompt = get_from_cache(ROOT_PROMPT)
-    session_id = str(uuid.uuid4())
-    session = await main_agent_session_service.create_session(
-        app_name=APP_NAME,
-        user_id=user_id,
-        session_id=session_id
-    )
+async def run_root_agent(user_id, prompt, styling_instructions, root_prompt):
+    return "".join([chunk async for chunk in stream_root_agent(user_id, prompt, styling_instructions, root_prompt,
+                                                               streaming=False)])
 
-    main_agent_runner = Runner(
-        agent=create_main_agent(),
-        app_name=APP_NAME,
-        session_service=main_agent_session_service
-    )
 
-    await _maybe_store_custom_component_prompt(prompt, session)
-    await _store_hashed_prompt_to_state(root_prompt + _maybe_extract_component_id_from_prompt(prompt), session)
-    await _store_styling_info_to_state(styling_instructions, session)
-
-    _maybe_invalidate_cache(root_prompt + _maybe_extract_component_id_from_prompt(prompt), prompt)
-
-    final_response_text = await _wait_for_result(main_agent_runner, user_id, session_id, prompt, lambda event: (
-            _is_cache_hit(event) or event.author in [
-        "component_page_merger_agent",
-        "main_page_agent",
-        "data_saver_agent",
-        "data_loader_agent"
-    ]
-    ))
-
-    reloaded_session = await main_agent_session_service.get_session(app_name=APP_NAME, user_id=user_id,
-                                                                    session_id=session_id)
-    cache_decision_agent_output = reloaded_session.state.get(
-        'cache_decision_agent_output').strip('\n')
-    if cache_decision_agent_output == 'CACHE':
-
-        # this combination is used to make sure that different styling of the component will be cached separately
-        cache_key = root_prompt + _maybe_extract_component_id_from_prompt(prompt)
-        store_to_cache(cache_key, final_response_text)
-    return final_response_text
+async def stream_root_agent(user_id, prompt, styling_instructions, root_prompt, streaming=True):
+    """
+       Runs the main agent and yields the response.
 
+       Args:
+           user_id: The id of the user
+           prompt: The prompt from the URL or the body of the /api request
+           styling_instructions: The future of the output of the style extraction agent, see start_style_extraction
+           root_prompt: The prompt of the page the request belongs to, the prompt itself for a page.
+               The components and the edits are cached per page.
+           streaming: If True, the HTML is yielded in chunks as the model generates it.
+               Otherwise, the whole response is yielded at once when it is complete.
+       """
+    response = _stream_response(user_id, prompt, styling_instructions, root_prompt, streaming)
+    if COMPONENT_TEMPLATES and _maybe_extract_component_id_from_prompt(prompt) != prompt:
+        # the component is a template which is cached as it is and filled with the current data on each request,
+        # the placeholders may be split between the chunks, so it is rendered only once complete.
+        # The data are loaded from the database, which must not block the other requests.
+        yield await asyncio.to_thread(render_template, "".join([chunk async for chunk in response]))
+        return
+    async for chunk in response:
+        yield chunk
+
+
+async def _stream_response(user_id, prompt, styling_instructions, root_prompt, streaming):
+    is_edit = _is_edit(prompt)
+    cache_key, cache_owner = _resolve_cache_key(user_id, prompt, root_prompt, is_edit)
+    if is_edit:
+        _invalidate_cache(cache_key, prompt)
+
+    # requests with a known shape skip the cache_decision_agent and the router
+    classification = classify_request(prompt)
+    if is_edit or (classification is not None and classification.agent_name == DATA_SAVER_AGENT):
+        # the user is waiting for the result of their action
+        request_priority.set(INTERACTIVE_PRIORITY)
+    if _is_coalescable(prompt, root_prompt, classification):
+        cached_response = await _get_cached_response(user_id, prompt, styling_instructions, classification, root_prompt,
+                                                     cache_key, cache_owner)
+        if cached_response is not CACHE_MISS:
+            yield cached_response
+            return
+    if classification is not None and classification.agent_name == DATA_LOADER_AGENT:
+        # the database calls (and the serialization of whole leagues) must not block the other requests
+        loaded_data = await asyncio.to_thread(load_data_directly, prompt)
+        if loaded_data is not None:
+            yield loaded_data
+            return
+    if classification is not None and classification.agent_name == DATA_SAVER_AGENT:
+        save_result = await asyncio.to_thread(save_match_directly, prompt)
+        if save_result is not None:
+            yield save_result
+            return
+
+    generation = functools.partial(_generate_response, user_id, prompt, styling_instructions, classification,
+                                   root_prompt, cache_key, cache_owner, streaming)
+    if _is_coalescable(prompt, root_prompt, classification):
+        # the concurrent visitors of the same page/component wait for one generation instead of each running their own
+        async for chunk in single_flight_stream(cache_key, generation):
+            yield chunk
+    elif is_edit:
+        # the stale value must not be regenerated from the original prompt while the edit is generating the new one
+        _edits_in_progress[cache_key] += 1
+        try:
+            async for chunk in generation():
+                yield chunk
+        finally:
+            _edits_in_progress[cache_key] -= 1
+            if not _edits_in_progress[cache_key]:
+                del _edits_in_progress[cache_key]
+    else:
+        async for chunk in generation():
+            yield chunk
+
+
+async def _get_cached_response(user_id, prompt, styling_instructions, classification, root_prompt, cache_key,
+                               cache_owner):
+    """
+       Looks up the page/component in the cache before running any agent.
+       With the STALE_WHILE_REVALIDATE, a stale value is returned as well and its regeneration is queued in the background.
+       Otherwise, only the classified components are looked up, the pages are looked up by the load_from_cache.
+
+       Returns:
+           The cached value or CACHE_MISS.
+       """
+    if not STALE_WHILE_REVALIDATE and classification is None:
+        return CACHE_MISS
+
+    cache_version = await _resolve_cache_version(prompt, styling_instructions)
+    if not STALE_WHILE_REVALIDATE:
+        return get_version_or_miss(cache_key, cache_version, _cache_namespace_of_prompt(prompt))
+
+    cached_response, stale = get_version_or_stale(cache_key, cache_version, _cache_namespace_of_prompt(prompt))
+    if stale and cache_key not in _edits_in_progress:
+        revalidate(cache_key, functools.partial(_generate_response, user_id, prompt, styling_instructions,
+                                                classification, root_prompt, cache_key, cache_owner, False))
+    return cached_response
 
-async def run_style_extraction_agent(user_id, prompt):
-    session_id = str(uuid.uuid4())
-    await style_extraction_service.create_session(
-        app_name=APP_NAME,
-        user_id=user_id,
-        session_id=session_id
-    )
-    style_extraction_agent_runner = Runner(
-        agent=_create_style_extraction_agent(),
-        app_name=APP_NAME,
-        session_service=style_extraction_service
-    )
+
+def _is_coalescable(prompt, root_prompt, classification) -> bool:
+    """
+       Only the rendering of the pages and the components can be shared by the concurrent requests.
+       The data must always be loaded/stored by each request and an edit of a component must get its own generation.
+       """
+    if 'invalidate_cache_key' in prompt:
+        return False
+    if classification is None:
+        return prompt == root_prompt
+    return classification.cache_decision == CACHE
+
+
+async def _generate_response(user_id, prompt, styling_instructions, classification, root_prompt, cache_key,
+                             cache_owner, streaming):
+    if classification is None:
+        main_agent_runner = _get_main_agent_runner()
+    else:
+        main_agent_runner = _get_routed_agent_runner(classification.agent_name)
+
+    initial_state = {
+        **_cache_decision_state(classification),
+        **_custom_component_prompt_state(prompt),
+        **_hashed_prompt_state(cache_key),
+        **_root_prompt_state(root_prompt),
+    }
+    async with main_agent_sessions.session(user_id, initial_state) as session:
+        # the styling is stored to the state only once an agent generating HTML needs it
+        pending_styling_instructions.set(styling_instructions)
+        # the version depends on the styling, so it is resolved only once the load_from_cache or the store needs it
+        cache_version = asyncio.ensure_future(_resolve_cache_version(prompt, styling_instructions))
+        cache_version.add_done_callback(lambda future: future.cancelled() or future.exception())
+        pending_cache_version.set(cache_version)
+        pending_cache_key.set(cache_key)
+
+        final_response_text = ""
+        response_cleaner = StreamingResponseCleaner()
+        streamed_authors = ["component_page_merger_agent", "main_page_agent"] if streaming else []
+        async for text, partial in _stream_result(main_agent_runner, user_id, session.id, prompt, lambda event: (
+                _is_cache_hit(event) or event.author in [
+            "component_page_merger_agent",
+            "main_page_agent",
+            "data_saver_agent",
+            "data_loader_agent"
+        ]
+        ), streamed_authors):
+            if partial:
+                cleaned_text = response_cleaner.feed(text)
+                if cleaned_text:
+                    yield cleaned_text
+            else:
+                final_response_text = text
+
+        remaining_text = response_cleaner.flush() if response_cleaner.started else final_response_text
+        if remaining_text:
+            yield remaining_text
+
+        reloaded_session = await main_agent_session_service.get_session(app_name=APP_NAME, user_id=user_id,
+                                                                        session_id=session.id)
+        if reloaded_session is None:
+            # the request has outlived the SESSION_TTL, so the session has been deleted as a stuck one
+            logger.warning("The session of '%s' has expired, the response is not cached", cache_key)
+            return
+        cache_decision_agent_output = (reloaded_session.state.get('cache_decision_agent_output') or "").strip('\n')
+    if cache_decision_agent_output == CACHE and cache_owner is not None:
+        store_user_version_to_cache(cache_owner, cache_key, await cache_version, final_response_text,
+                                    _cache_namespace_of_prompt(prompt))
+    elif cache_decision_agent_output == CACHE:
+        store_version_to_cache(cache_key, await cache_version, final_response_text,
+                               _cache_namespace_of_prompt(prompt))
+
+
+def session_metrics() -> dict[str, dict[str, int]]:
+    """
+       The counts of the sessions created, deleted and still alive, per session service.
+       """
+    return {
+        "main_agent": main_agent_sessions.metrics(),
+        "style_extraction": style_extraction_sessions.metrics(),
+    }
+
+
+def _collect_session_metrics():
+    for service, service_metrics in session_metrics().items():
+        for state, count in service_metrics.items():
+            sessions_metric.set(count, service=service, state=state)
+    for service, ephemeral_sessions in [("main_agent", main_agent_sessions),
+                                        ("style_extraction", style_extraction_sessions)]:
+        for measure, value in ephemeral_sessions.user_state_metrics().items():
+            user_state_metric.set(value, service=service, measure=measure)
+
+
+register_collector(_collect_session_metrics)
+
+
+def start_style_extraction(user_id, prompt, request_prompt=None) -> asyncio.Future:
+    """
+       Starts the style extraction in the background, so that the rest of the pipeline does not have to wait for it.
+       Only the agents generating HTML wait for the result, see inject_styling_instructions.
+
+       Args:
+           user_id: The id of the user
+           prompt: The prompt of the page the styling is extracted from, empty if the page is not known
+           request_prompt: The prompt of the request being handled, if it is not the page itself.
+               The data loads and saves generate no HTML, so they get no styling.
+
+       Returns:
+           The future of the styling instructions.
+       """
+    if not prompt or (request_prompt is not None and _is_data_request(request_prompt)):
+        return _resolved_future(NO_STYLING_INSTRUCTIONS)
 
     cache_key = f"{STYLING_INSTRUCTIONS} {prompt}"
-    if is_cached(cache_key):
-        return get_from_cache(cache_key)
+    cached_styling_instructions = get_version_or_miss(cache_key, _get_style_extraction_fingerprint(), STYLE_NAMESPACE)
+    if cached_styling_instructions is not CACHE_MISS:
+        return _resolved_future(cached_styling_instructions)
+
+    styling_instructions = asyncio.ensure_future(run_style_extraction_agent(user_id, prompt))
+    # the requests served without any HTML generation never await it, the failure will be reported by the next request
+    styling_instructions.add_done_callback(lambda future: future.cancelled() or future.exception())
+    return styling_instructions
+
+
+def _is_data_request(prompt) -> bool:
+    classification = classify_request(prompt)
+    return classification is not None and classification.agent_name in (DATA_LOADER_AGENT, DATA_SAVER_AGENT)
+
+
+def _resolved_future(value) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+async def run_style_extraction_agent(user_id, prompt):
+    cache_key = f"{STYLING_INSTRUCTIONS} {prompt}"
+    cached_styling_instructions = get_version_or_miss(cache_key, _get_style_extraction_fingerprint(), STYLE_NAMESPACE)
+    if cached_styling_instructions is not CACHE_MISS:
+        return cached_styling_instructions
+
+    # all the concurrent requests of the same page share one extraction
+    return await single_flight(cache_key, functools.partial(_extract_style, user_id, prompt, cache_key))
+
+
+async def _extract_style(user_id, prompt, cache_key):
+    # all the requests of the page, including the ones served from the cache, wait for the styling
+    request_priority.set(INTERACTIVE_PRIORITY)
+    style_extraction_agent_runner = _get_style_extraction_runner()
 
-    final_response_text = await _wait_for_result(style_extraction_agent_runner, user_id, session_id, prompt)
+    async with style_extraction_sessions.session(user_id) as session:
+        # without any streamed authors, only the complete final response is yielded
+        async for final_response_text, _ in _stream_result(style_extraction_agent_runner, user_id, session.id,
+                                                           prompt):
+            pass
 
-    store_to_cache(cache_key, final_response_text)
+    store_version_to_cache(cache_key, _get_style_extraction_fingerprint(), final_response_text, STYLE_NAMESPACE)
     return final_response_text
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import os
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse, LLMRegistry
+
+from mawa.llm import register_llm
+from mawa.metrics import model_calls_rejected, model_slots, register_collector
+
+# The priority classes of the model calls, the lower the sooner a free slot of the model is given to the call.
+# The edits and the saves of the data the user waits for go first, then the pages and components being loaded,
+# then the regenerations in the background.
+INTERACTIVE_PRIORITY = 0
+LOAD_PRIORITY = 1
+BACKGROUND_PRIORITY = 2
+_PRIORITY_NAMES = {INTERACTIVE_PRIORITY: "interactive", LOAD_PRIORITY: "load", BACKGROUND_PRIORITY: "background"}
+
+# The maximal number of the concurrent calls per model, e.g. "gemini-2.5-flash=4,gemini-2.0-flash-lite=16".
+# The models not listed get the DEFAULT_MODEL_CONCURRENCY, 0 means no limit.
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("DEFAULT_MODEL_CONCURRENCY", "16"))
+MODEL_CONCURRENCY = {
+    model.strip(): int(limit)
+    for model, _, limit in (item.partition("=") for item in os.getenv("MODEL_CONCURRENCY", "").split(",") if item)
+}
+# The maximal number of the calls waiting for a free slot per model. The calls beyond it are rejected right away.
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "64"))
+# How long (in seconds) a call waits for a free slot before it is rejected.
+MODEL_QUEUE_TIMEOUT = float(os.getenv("MODEL_QUEUE_TIMEOUT", "30"))
+
+# The priority of the model calls of the request which is being handled, set by the adk_bridge and the revalidation.
+request_priority: ContextVar[int] = ContextVar("request_priority", default=LOAD_PRIORITY)
+
+
+class ModelOverloaded(Exception):
+    """Raised if a model call is not admitted, because too many calls of the model are waiting already."""
+
+
+class _ModelSlots:
+    """
+    A semaphore whose waiters are woken up by their priority (and in the order they came within the same priority).
+    """
+
+    def __init__(self, model: str, size: int):
+        self.model = model
+        self.size = size
+        self.in_use = 0
+        # (priority, sequence number, future) of each waiting call
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if self.in_use < self.size and not self._waiters:
+            self.in_use += 1
+            return
+        if len(self._waiters) >= MODEL_QUEUE_SIZE:
+            raise self._rejected(priority, "too many calls are waiting")
+
+        waiter = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        try:
+            async with asyncio.timeout(MODEL_QUEUE_TIMEOUT):
+                await waiter[2]
+        except BaseException as e:
+            if waiter[2].done() and not waiter[2].cancelled():
+                # the slot has been handed over right before the cancellation
+                self.release()
+            else:
+                waiter[2].cancel()
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            if isinstance(e, TimeoutError):
+                raise self._rejected(priority, f"no slot got free in {MODEL_QUEUE_TIMEOUT} seconds") from None
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # the slot is handed over to the waiter, so nobody can take it meanwhile
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+    def _rejected(self, priority: int, reason: str) -> ModelOverloaded:
+        model_calls_rejected.inc(model=self.model, priority=_PRIORITY_NAMES.get(priority, str(priority)))
+        return ModelOverloaded(f"The call of the {self.model} has not been admitted: {reason}")
+
+
+_model_slots: dict[str, Optional[_ModelSlots]] = {}
+
+
+def _get_model_slots(model: str) -> Optional[_ModelSlots]:
+    if model not in _model_slots:
+        size = MODEL_CONCURRENCY.get(model, DEFAULT_MODEL_CONCURRENCY)
+        _model_slots[model] = _ModelSlots(model, size) if size > 0 else None
+    return _model_slots[model]
+
+
+class AdmissionControlledLlm(BaseLlm):
+    """
+    Admits at most the MODEL_CONCURRENCY calls of each model at once, the others wait for a slot by their
+    request_priority. Only the model calls are limited, the requests answered from the cache never wait.
+    Mixed into the model class the models resolve to, see install_admission_control.
+    """
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        slots = _get_model_slots(llm_request.model or self.model)
+        if slots is None:
+            async for llm_response in super().generate_content_async(llm_request, stream):
+                yield llm_response
+            return
+
+        await slots.acquire(request_priority.get())
+        released = False
+        try:
+            async for llm_response in super().generate_content_async(llm_request, stream):
+                if not llm_response.partial and not released:
+                    # the call is complete, ADK may keep the generator open long after the last response
+                    slots.release()
+                    released = True
+                yield llm_response
+        finally:
+            if not released:
+                slots.release()
+
+
+def install_admission_control(model: str):
+    """
+    Makes the models resolving to the same class as the given one (e.g. all the gemini-* models) admission controlled.
+    Has to be called after any other replacement of the model class, e.g. the install_llm_cassette.
+    """
+    llm_class = LLMRegistry.resolve(model)
+    if issubclass(llm_class, AdmissionControlledLlm):
+        return
+    register_llm(type(f"AdmissionControlled{llm_class.__name__}", (AdmissionControlledLlm, llm_class),
+                      {"__module__": __name__}))
+
+
+def _collect_model_slot_metrics():
+    for model, slots in list(_model_slots.items()):
+        if slots is not None:
+            model_slots.set(slots.in_use, model=model, state="in_use")
+            model_slots.set(slots.waiting, model=model, state="waiting")
+
+
+register_collector(_collect_model_slot_metrics)
@@ -1,14 +1,26 @@
+import hashlib
 import os
+import shlex
+import sys
 from typing import Optional
 
-from google.adk.agents import Agent, ParallelAgent, SequentialAgent
+from google.adk.agents import Agent, BaseAgent, SequentialAgent
 from google.adk.planners import BuiltInPlanner
-from google.adk.tools.mcp_tool import MCPToolset
 from google.genai.types import GenerateContentConfig, ThinkingConfig
 from mcp import StdioServerParameters
 
-from mawa.callbacks import clear_technical_response, inject_stored_component_ids, load_from_cache
+from mawa import tools
+from mawa.admission import install_admission_control
+from mawa.callbacks import clear_technical_response, inject_stored_component_ids, inject_styling_instructions, \
+    load_from_cache, record_model_call_end, record_model_call_start, record_tool_call_end, record_tool_call_start, \
+    return_single_component_output
+from mawa.component_dispatch import ComponentDispatcher
+from mawa.component_templates import COMPONENT_TEMPLATES, DATA_PLACEHOLDER, DATA_REQUEST_ATTRIBUTE, \
+    data_loading_instructions
 from mawa.constants import STYLING_INSTRUCTIONS, CURRENT_PROMPT_HASH
+from mawa.llm import install_llm_cassette
+from mawa.mcp_pool import PooledMCPToolset
+from mawa.request_classifier import COMPONENT_PAGE_AGENT, DATA_LOADER_AGENT, DATA_SAVER_AGENT, MAIN_PAGE_AGENT
 
 STYLING_INSTRUCTIONS_SECTION = f"""
             ## Styling Instructions
@@ -16,24 +28,60 @@ STYLING_INSTRUCTIONS_SECTION = f"""
                 - Always follow the following styling instructions: {{{STYLING_INSTRUCTIONS}}}
 """
 
+# the outputs of the visualization agents are templates the server fills the data into, see COMPONENT_TEMPLATES
+_KEEP_TEMPLATE_PLACEHOLDERS_RULE = f"""
+                - Keep the {DATA_PLACEHOLDER} and the <script {DATA_REQUEST_ATTRIBUTE}> tags from the outputs of the previous agents exactly as they are.""" \
+    if COMPONENT_TEMPLATES else ""
+
 STRICT_AGENT_TEMPERATURE = 0.0
 CREATIVE_AGENT_TEMPERATURE = 1.5
 MODEL_FULL = "gemini-2.5-flash"
 MODEL_LITE = "gemini-2.0-flash-lite"
 NOT_THINKING_MODEL = "gemini-1.5-flash"
 
-_data_provider_mcp_toolset = MCPToolset(
+# "mcp" talks to the data provider MCP server over stdio, "in_process" calls the same tools directly from mawa.tools
+DATA_PROVIDER_TRANSPORT = os.getenv("DATA_PROVIDER_TRANSPORT", "mcp")
+DATA_PROVIDER_POOL_SIZE = int(os.getenv("DATA_PROVIDER_POOL_SIZE", "2"))
+DATA_PROVIDER_COMMAND = os.getenv(
+    "DATA_PROVIDER_COMMAND",
+    shlex.join([
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mawa_mcp_server", "data_provider.py")
+    ])
+)
+
+_data_provider_mcp_toolset = PooledMCPToolset(
     connection_params=StdioServerParameters(
-        command='poetry',
-        args=[
-            "run",
-            "mcp",
-            "run",
-            os.path.abspath("/home/jelene/work/mawa/src/mawa_mcp_server/data_provider.py")
-        ],
+        command=shlex.split(DATA_PROVIDER_COMMAND)[0],
+        args=shlex.split(DATA_PROVIDER_COMMAND)[1:],
+        # the server needs the same configuration (e.g. the MATCHES_DATABASE_FILE) as this process
+        env=dict(os.environ),
     ),
+    size=DATA_PROVIDER_POOL_SIZE,
 )
 
+install_llm_cassette()
+# all the gemini-* models resolve to the same class, so all of them are admission controlled
+install_admission_control(MODEL_FULL)
+
+
+def _create_data_provider_tools():
+    if DATA_PROVIDER_TRANSPORT == "in_process":
+        return [tools.get_matches, tools.add_match]
+    return [_data_provider_mcp_toolset]
+
+
+async def start_data_provider():
+    """
+    Starts the data provider MCP servers so that the first requests do not wait for them.
+    """
+    if DATA_PROVIDER_TRANSPORT != "in_process":
+        await _data_provider_mcp_toolset.warm_up()
+
+
+async def stop_data_provider():
+    await _data_provider_mcp_toolset.close()
+
 
 def _create_style_extraction_agent():
     return Agent(
@@ -60,6 +108,8 @@ def _create_style_extraction_agent():
                     - Add instructions for how to behave in case of this instructions dont contain the description explicitely. 
             """
         ),
+        before_model_callback=record_model_call_start,
+        after_model_callback=record_model_call_end,
     )
 
 def _create_main_page_agent(default_session_variables: Optional[dict[str, str]]):
@@ -103,9 +153,16 @@ def _create_main_page_agent(default_session_variables: Optional[dict[str, str]])
                     - while the component is loading, replace the content of detail-component-id by something which will tell the user the component is being re-loaded..
             
                 ## content_part
-                    - the body will be a <div> with an id field and a <script> which will load the content of the div.
+                    - the body will be a <div> with an id field, a data-component-id attribute containing the id of the component and a data-component-prompt attribute containing the body->prompt.
+                    - make sure the value of the data-component-prompt attribute is HTML-escaped.
+                    - the content of the div is loaded by the script described in the "Loading Components" section, never add a <script> loading it to the content_part.
                     - An example:
-                        <div id="detail-component-id-1" class="loading-message">Loading Component...</div>
+                        <div id="detail-component-id-1" class="loading-message" data-component-id="component_1_1" data-component-prompt="Generate me a fun fact about cats.">Loading Component...</div>
+                    - if the body->prompt is not specified, use the following text as the data-component-prompt: "Generate a simple div containing Hello from a div text inside".
+
+                ## Loading Components
+                    - at the end of the body, add exactly one <script> which loads all the components in a single request and which defines the updateComponent function used by the edit dialogs.
+                    - The script:
                         <script>
                            function loadHTMLWithScripts(html, targetId) {{
                                 const targetElement = document.getElementById(targetId);
@@ -141,24 +198,33 @@ def _create_main_page_agent(default_session_variables: Optional[dict[str, str]])
                                 console.error('Error:', error);
                             }});
                         }}
-                        // Initial load
-                          fetch('/api', {{
-                                method: 'POST',
-                                headers: {{
-                                    'Content-Type': 'application/json'
-                                }},
-                                body: JSON.stringify({{'id': 'component_1_1', 'prompt': 'Generate me a fun fact about cats.'}})
-                            }})
-                            .then(res => res.text())
-                            .then(html => {{
-                                loadHTMLWithScripts(html, 'detail-component-id-1');
-                            }})
-                            .catch(error => {{
-                                document.getElementById('detail-component-id-1').innerHTML = '<div style="color: red;">Error loading component.</div>';
-                                console.error('Error:', error);
+                        // Initial load of all the components, the ones inlined by the server are not placeholders
+                        const componentDivs = Array.from(document.querySelectorAll('[data-component-id]'));
+                        if (componentDivs.length > 0) fetch('/api/batch', {{
+                            method: 'POST',
+                            headers: {{
+                                'Content-Type': 'application/json'
+                            }},
+                            body: JSON.stringify(componentDivs.map(div => ({{'id': div.dataset.componentId, 'prompt': div.dataset.componentPrompt}})))
+                        }})
+                        .then(res => res.json())
+                        .then(results => {{
+                            componentDivs.forEach(div => {{
+                                const result = results[div.dataset.componentId];
+                                if (result && result.html !== undefined) {{
+                                    loadHTMLWithScripts(result.html, div.id);
+                                }} else {{
+                                    div.innerHTML = '<div style="color: red;">Error loading component.</div>';
+                                }}
                             }});
+                        }})
+                        .catch(error => {{
+                            componentDivs.forEach(div => {{
+                                div.innerHTML = '<div style="color: red;">Error loading component.</div>';
+                            }});
+                            console.error('Error:', error);
+                        }});
                         </script>
-                    - if the body is not specified, add the following text to it: "{{'id': the generated id for this component, 'prompt': 'Generate a simple div containing Hello from a div text inside', 'invalidate_cache_key': '{{{CURRENT_PROMPT_HASH}}}'}}."
             
                 ## Default Main Section Layout
                     - Refer to the "Instructions Provided by Users Per Component" section, to get the default body values per component ID. If this section is not present, use the following defaults:
@@ -185,8 +251,9 @@ def _create_main_page_agent(default_session_variables: Optional[dict[str, str]])
         instruction=(
             instructions
         ),
-        before_model_callback=inject_stored_component_ids,
-        after_model_callback=clear_technical_response,
+        before_model_callback=[inject_stored_component_ids, record_model_call_start],
+        before_agent_callback=inject_styling_instructions,
+        after_model_callback=[record_model_call_end, clear_technical_response],
     )
 
 
@@ -233,9 +300,12 @@ def _create_data_loader_agent():
                     - Convert the output from the get_matches tool to conform to the output_format requested.
             """
         ),
-        after_model_callback=clear_technical_response,
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
 
-        tools=[_data_provider_mcp_toolset]
+        before_tool_callback=record_tool_call_start,
+        after_tool_callback=record_tool_call_end,
+        tools=_create_data_provider_tools()
     )
 
 
@@ -258,19 +328,7 @@ def _create_tabular_data_visualization_agent():
                 - DO NOT include any conversational text, explanations, or extraneous characters outside the HTML structure.
                 - If no table generation is requested, return the literal string `NO_CONTENT`.
             
-            ## Table Generation Rules:
-                ### Data Loading:
-                    - Data MUST be loaded asynchronously via a `POST` request to the `/api` endpoint. 
-                    - Generate a <script> tag which uses XHR to load the data.
-                    - Make sure this script will call the server right after this component is done rendering.
-                    - Never add an ADD button to the component. 
-                    - Add a reload button. If clicked, the same server call will be executed loading the data again.
-                    - The `POST` request body MUST be a JSON object specifying:
-                        - `request`: "load data",
-                        - `source`: (string) The origin or identifier of the data.
-                        - `format`: (string) The desired data format (e.g., 'JSON', 'CSV').
-                        - `output_format`: (object) The output structure the table generated by you can process. For instance, to get a list of users, the structure would be `[{{'name': 'userName', 'age': 'userAge'}}]`.
-                    - While data is loading, display a prominent loading indicator within the table structure.
+            ## Table Generation Rules:{data_loading_instructions("table")}
                 
                 ### Example Request Body for Data Loading:
                 {{
@@ -292,7 +350,9 @@ def _create_tabular_data_visualization_agent():
 {STYLING_INSTRUCTIONS_SECTION}
         """
         ),
-        after_model_callback=clear_technical_response,
+        before_agent_callback=inject_styling_instructions,
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
         output_key="tabular_data_visualization_agent_output"
     )
 
@@ -316,19 +376,7 @@ def _create_chart_data_visualization_agent():
                 - DO NOT include any conversational text, explanations, or extraneous characters outside the HTML structure.
                 - If no chart generation is requested, return the literal string `NO_CONTENT`.
             
-            ## Chart Generation Rules:
-                ### Data Loading:
-                    - Data MUST be loaded asynchronously via a `POST` request to the `/api` endpoint. 
-                    - Generate a <script> tag which uses XHR to load the data.
-                    - Make sure this script will call the server right after this component is done rendering.
-                    - Never add an ADD button to the component. 
-                    - Add a reload button. If clicked, the same server call will be executed loading the data again.
-                    - The `POST` request body MUST be a JSON object specifying:
-                        - `request`: "load data",
-                        - `source`: (string) The origin or identifier of the data.
-                        - `format`: (string) The desired data format (e.g., 'JSON', 'CSV').
-                        - `output_format`: (object) The output structure the chart generated by you can process. For instance, to get a list of users, the structure would be `[{{'name': 'userName', 'age': 'userAge'}}]`.
-                    - While data is loading, display a prominent loading indicator within the chart structure.
+            ## Chart Generation Rules:{data_loading_instructions("chart")}
                     - Once the data is loaded, show the chart visualizing the date returned from the server. 
             
                 ### Example Request Body for Data Loading:
@@ -351,7 +399,9 @@ def _create_chart_data_visualization_agent():
 {STYLING_INSTRUCTIONS_SECTION}
         """
         ),
-        after_model_callback=clear_technical_response,
+        before_agent_callback=inject_styling_instructions,
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
         output_key="chart_data_visualization_agent_output"
     )
 
@@ -403,7 +453,8 @@ def _create_add_data_to_table_agent():
                     - After this, a json will continue with the data. The json will encode all the data from the dialog form.
             """
         ),
-        after_model_callback=clear_technical_response,
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
         output_key="add_data_agent_output"
     )
 
@@ -429,24 +480,27 @@ def _create_component_page_merger_agent():
                 - If the input contains a request to generate a chart, add the {{chart_data_visualization_agent_output}} to your output.
                 - If the input contains a request to add a new match component or form, add the {{add_data_agent_output}} to your output.         
                 - If the request did not contain any of the two above requests, ignore the output from the previous agents and generate your output directly.
-                - Never add the string "NO_CONTENT" directly to the output
+                - Never add the string "NO_CONTENT" directly to the output{_KEEP_TEMPLATE_PLACEHOLDERS_RULE}
             
 {STYLING_INSTRUCTIONS_SECTION}
         """
         ),
-        after_model_callback=clear_technical_response,
+        # the styling is not waited for if there is nothing to merge
+        before_agent_callback=[return_single_component_output, inject_styling_instructions],
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
     )
 
 
 def _create_component_parallel_sub_agents():
-    return ParallelAgent(
+    return ComponentDispatcher(
         name="component_parallel_sub_agents",
         sub_agents=[
             _create_tabular_data_visualization_agent(),
             _create_chart_data_visualization_agent(),
             _create_add_data_to_table_agent(),
         ],
-        description="Gets the user input and calls all sub agents in parallel to generate their portion of the output."
+        description="Gets the user input and calls the sub agents it needs in parallel to generate their portion of the output."
     )
 
 def _create_component_page_agent():
@@ -494,8 +548,11 @@ def _create_data_saver_agent():
             The only success case is, if the tool has been successfully called. Never return success without attempting to call a tool.
             """
         ),
-        after_model_callback=clear_technical_response,
-        tools=[_data_provider_mcp_toolset],
+        before_model_callback=record_model_call_start,
+        after_model_callback=[record_model_call_end, clear_technical_response],
+        before_tool_callback=record_tool_call_start,
+        after_tool_callback=record_tool_call_end,
+        tools=_create_data_provider_tools(),
     )
 
 
@@ -524,7 +581,9 @@ def _create_root_agent(default_session_variables: Optional[dict[str, str]]):
             _create_data_loader_agent(),
             _create_data_saver_agent(),
         ],
-        before_model_callback=load_from_cache,
+        # the cached responses are not counted as model calls
+        before_model_callback=[load_from_cache, record_model_call_start],
+        after_model_callback=record_model_call_end,
     )
 
 
@@ -550,6 +609,8 @@ def _create_cache_decision_agent():
             Return only 'LIVE' or 'CACHE'.
             """
         ),
+        before_model_callback=record_model_call_start,
+        after_model_callback=record_model_call_end,
         output_key="cache_decision_agent_output"
     )
 
@@ -562,3 +623,46 @@ def create_main_agent(default_session_variables: Optional[dict[str, str]] = None
         ],
         description="Decides if to return the result from cache or live. Than proceeds to load or calculate the result."
     )
+
+
+def create_routed_agent(agent_name: str, default_session_variables: Optional[dict[str, str]] = None):
+    """
+    Creates one of the sub-agents of the generic_webpage_root_agent so that a request which has already been
+    classified can be dispatched to it directly, without the cache_decision_agent and the router.
+    """
+    if agent_name == MAIN_PAGE_AGENT:
+        return _create_main_page_agent(default_session_variables)
+    if agent_name == COMPONENT_PAGE_AGENT:
+        return _create_component_page_agent()
+    if agent_name == DATA_LOADER_AGENT:
+        return _create_data_loader_agent()
+    if agent_name == DATA_SAVER_AGENT:
+        return _create_data_saver_agent()
+    raise ValueError(f"Unknown agent: '{agent_name}'")
+
+
+def agent_fingerprint(agent: BaseAgent) -> str:
+    """
+    Hashes everything which influences the output of the agent and its sub-agents:
+    the instructions, the models and their configuration.
+    The generations cached with a different fingerprint are not served anymore.
+    """
+    digest = hashlib.sha256()
+    _update_agent_fingerprint(digest, agent)
+    return digest.hexdigest()
+
+
+def _update_agent_fingerprint(digest, agent: BaseAgent):
+    digest.update(agent.name.encode("utf-8"))
+    digest.update(type(agent).__name__.encode("utf-8"))
+    if isinstance(agent, Agent):
+        model = agent.model if isinstance(agent.model, str) else agent.model.model
+        instruction = agent.instruction if isinstance(agent.instruction, str) else agent.instruction.__qualname__
+        config = agent.generate_content_config.model_dump_json(exclude_none=True) \
+            if agent.generate_content_config else ""
+        thinking_config = agent.planner.thinking_config.model_dump_json(exclude_none=True) \
+            if isinstance(agent.planner, BuiltInPlanner) else ""
+        for part in [model, instruction, config, thinking_config]:
+            digest.update(part.encode("utf-8"))
+    for sub_agent in agent.sub_agents:
+        _update_agent_fingerprint(digest, sub_agent)
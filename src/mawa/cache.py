@@ -1,46 +1,288 @@
+import functools
 import os
+import threading
 
+from cachetools import TTLCache
 from diskcache import Cache
 import hashlib
 
+from mawa.metrics import cache_operations
+from mawa.similarity import band_keys, estimate_similarity, minhash_signature, normalize_prompt
+
 cache_dir = os.getenv("CACHE_DIR")
 
+# The in-memory cache in front of the file-based one, holding the most recently used values.
+# The size is in bytes of the values. The TTL bounds how long a value deleted by a different process can still be served.
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", str(64 * 1024 * 1024)))
+MEMORY_CACHE_TTL = float(os.getenv("MEMORY_CACHE_TTL", "30"))
+
+# The maximal size (in bytes) of the values cached for a single user (e.g. the components only they have edited).
+# Their oldest values are removed once it is exceeded, the values shared by all the users are not affected.
+USER_CACHE_QUOTA = int(os.getenv("USER_CACHE_QUOTA", str(4 * 1024 * 1024)))
+
+# How similar (0 to 1) two prompts have to be for the second one to reuse the generations of the first one.
+# Prompts differing only in the case, punctuation or whitespace always reuse them.
+SIMILAR_PROMPT_THRESHOLD = float(os.getenv("SIMILAR_PROMPT_THRESHOLD", "0.9"))
+# The maximal number of prompts kept in one LSH bucket, bounding the cost of a lookup.
+SIMILAR_PROMPT_BUCKET_SIZE = 32
+
+# Returned by the get_or_miss if the key is not cached.
+CACHE_MISS = object()
+
+# The namespaces of the versioned values, used as the label of the cache metrics.
+STYLE_NAMESPACE = "style"
+PAGE_NAMESPACE = "page"
+COMPONENT_NAMESPACE = "component"
+MEMORY_NAMESPACE = "memory"
+# The values describing a single user (e.g. the components they have edited), accounted to their USER_CACHE_QUOTA.
+USER_NAMESPACE = "user"
+
+# The version a value marked stale is moved to, no generator has this version so it is only served as stale.
+STALE_VERSION = "stale"
+
 cache = None
 if cache_dir:
     cache = Cache(cache_dir)
 
+class _MemoryCache(TTLCache):
+
+    def popitem(self):
+        # only called to make space for a new value, the expired values are removed by the expire
+        item = super().popitem()
+        cache_operations.inc(namespace=MEMORY_NAMESPACE, result="evict")
+        return item
+
+memory_cache = _MemoryCache(maxsize=MEMORY_CACHE_SIZE, ttl=MEMORY_CACHE_TTL,
+                            getsizeof=lambda value: len(value) if isinstance(value, (str, bytes)) else 1)
+memory_cache_lock = threading.Lock()
+
 def store_to_cache(key, value):
     """
-    Stores a value in the file-based cache.
+    Stores a value in the file-based cache and in the in-memory cache.
     """
     if cache is not None:
-        cache.set(key_to_hash(key), value)
+        hashed_key = key_to_hash(key)
+        cache.set(hashed_key, value)
+        _store_to_memory_cache(hashed_key, value)
 
 def is_cached(key):
     """
-    Checks if a key is present in the file-based cache.
+    Checks if a key is present in the cache.
+    The value is loaded to the in-memory cache, so the get_from_cache which usually follows does not hit the disk.
     """
-    if cache is not None:
-        return key_to_hash(key) in cache
-    else:
-        return False
+    return get_or_miss(key) is not CACHE_MISS
 
 def get_from_cache(key):
     """
-    Retrieves a value from the file-based cache.
+    Retrieves a value from the cache.
     """
     if cache is not None:
-        return cache.get(key_to_hash(key))
+        value = get_or_miss(key)
+        return None if value is CACHE_MISS else value
     else:
         return ""
 
+def get_or_miss(key):
+    """
+    Retrieves a value from the cache with a single lookup, first in memory, then in the file-based cache.
+
+    Returns:
+        The value or CACHE_MISS if the key is not cached.
+    """
+    if cache is None:
+        return CACHE_MISS
+
+    hashed_key = key_to_hash(key)
+    with memory_cache_lock:
+        value = memory_cache.get(hashed_key, CACHE_MISS)
+    if value is not CACHE_MISS:
+        cache_operations.inc(namespace=MEMORY_NAMESPACE, result="hit")
+        return value
+    cache_operations.inc(namespace=MEMORY_NAMESPACE, result="miss")
+
+    value = cache.get(hashed_key, default=CACHE_MISS)
+    if value is not CACHE_MISS:
+        _store_to_memory_cache(hashed_key, value)
+    return value
+
 def clear_from_cache(key):
     """
-    Removes a key-value pair from the file-based cache.
+    Removes a key-value pair from the cache.
+    """
+    if cache is not None:
+        hashed_key = key_to_hash(key)
+        cache.delete(hashed_key)
+        with memory_cache_lock:
+            memory_cache.pop(hashed_key, None)
+
+def store_version_to_cache(key, version, value, namespace):
+    """
+    Stores a value generated by the given version of the generator (e.g. a fingerprint of the agents and the styling).
+    Only one version of the key is kept, the previous version is deleted. The keys of the versions which are never
+    regenerated are removed only once the file-based cache reaches its size limit.
+    The new value replaces the previous one (also a stale one) in a single transaction.
     """
     if cache is not None:
-        cache.delete(key_to_hash(key))
+        with cache.transact():
+            previous_version = get_from_cache(_version_index_key(key))
+            store_to_cache(_versioned_key(key, version), value)
+            store_to_cache(_version_index_key(key), version)
+            if previous_version is not None and previous_version != version:
+                clear_from_cache(_versioned_key(key, previous_version))
+                cache_operations.inc(namespace=namespace, result="evict")
+
+def store_user_version_to_cache(user_id, key, version, value, namespace):
+    """
+    Stores a value only the given user gets (see the store_version_to_cache) and accounts it to the USER_CACHE_QUOTA
+    of the user. Once the quota is exceeded, the oldest values of the user are removed.
+    """
+    if cache is not None:
+        with cache.transact():
+            store_version_to_cache(key, version, value, namespace)
+            user_index_key = _user_index_key(user_id)
+            # [key, namespace, size] of each value of the user, the oldest first
+            user_entries = [entry for entry in get_from_cache(user_index_key) or [] if entry[0] != key]
+            user_entries.append([key, namespace, _size_of(value)])
+            while len(user_entries) > 1 and sum(entry[2] for entry in user_entries) > USER_CACHE_QUOTA:
+                evicted_key, evicted_namespace, _ = user_entries.pop(0)
+                clear_version_from_cache(evicted_key, evicted_namespace)
+            store_to_cache(user_index_key, user_entries)
+
+def _size_of(value):
+    return len(value) if isinstance(value, (str, bytes)) else len(repr(value))
+
+def get_version_or_miss(key, version, namespace):
+    """
+    Retrieves the value of the given version of the key.
+
+    Returns:
+        The value or CACHE_MISS if this version of the key is not cached.
+    """
+    value = get_or_miss(_versioned_key(key, version))
+    cache_operations.inc(namespace=namespace, result="miss" if value is CACHE_MISS else "hit")
+    return value
+
+def get_version_or_stale(key, version, namespace):
+    """
+    Retrieves the value of the given version of the key. If a different version of the key is cached instead,
+    (e.g. the agents have changed, or it has been marked stale), its value is returned, flagged as stale.
+
+    Returns:
+        The (value, stale) tuple, (CACHE_MISS, False) if no version of the key is cached.
+    """
+    if cache is None:
+        return CACHE_MISS, False
+
+    value = get_or_miss(_versioned_key(key, version))
+    if value is not CACHE_MISS:
+        cache_operations.inc(namespace=namespace, result="hit")
+        return value, False
+    stored_version = get_from_cache(_version_index_key(key))
+    value = CACHE_MISS if stored_version is None else get_or_miss(_versioned_key(key, stored_version))
+    cache_operations.inc(namespace=namespace, result="miss" if value is CACHE_MISS else "stale")
+    return value, value is not CACHE_MISS
+
+def mark_version_stale(key, namespace):
+    """
+    Marks the currently stored version of the key stale by moving it to the STALE_VERSION.
+    It is then only returned by the get_version_or_stale, until a new version is stored.
+    """
+    if cache is not None:
+        with cache.transact():
+            version = get_from_cache(_version_index_key(key))
+            if version is None or version == STALE_VERSION:
+                return
+            value = get_or_miss(_versioned_key(key, version))
+            if value is CACHE_MISS:
+                return
+            store_to_cache(_versioned_key(key, STALE_VERSION), value)
+            store_to_cache(_version_index_key(key), STALE_VERSION)
+            clear_from_cache(_versioned_key(key, version))
+            cache_operations.inc(namespace=namespace, result="evict")
+
+def clear_version_from_cache(key, namespace):
+    """
+    Removes the currently stored version of the key.
+    """
+    if cache is not None:
+        version = get_from_cache(_version_index_key(key))
+        if version is not None:
+            clear_from_cache(_versioned_key(key, version))
+            clear_from_cache(_version_index_key(key))
+            cache_operations.inc(namespace=namespace, result="evict")
+
+def resolve_similar_prompt(prompt):
+    """
+    Finds a previously seen prompt which is similar enough to the given one that their generations can be shared.
+    The lookup goes through the LSH buckets of the MinHash signature of the prompt, so its cost does not grow
+    with the number of the seen prompts.
+
+    Returns:
+        The similar prompt seen before, or the given prompt, which is then remembered for the following lookups.
+    """
+    if cache is None:
+        return prompt
+
+    normalized_prompt = normalize_prompt(prompt)
+    same_prompt = get_from_cache(f"normalized prompt {normalized_prompt}")
+    if same_prompt is not None:
+        return same_prompt
+
+    signature = minhash_signature(normalized_prompt)
+    buckets = [f"similar prompts {band_key}" for band_key in band_keys(signature)]
+    best_similarity, best_prompt = 0.0, None
+    invalid_buckets = []
+    for bucket in buckets:
+        bucket_entries = get_from_cache(bucket) or []
+        # [prompt, signature] of each prompt of the bucket, the signature is kept along so that it is never missing
+        valid_entries = [entry for entry in bucket_entries if _is_similar_prompt_entry(entry, signature)]
+        if len(valid_entries) != len(bucket_entries):
+            invalid_buckets.append(bucket)
+        for candidate, candidate_signature in valid_entries:
+            similarity = estimate_similarity(signature, candidate_signature)
+            if similarity > best_similarity:
+                best_similarity, best_prompt = similarity, candidate
+    if invalid_buckets:
+        _remove_invalid_similar_prompt_entries(invalid_buckets, signature)
+    if best_prompt is not None and best_similarity >= SIMILAR_PROMPT_THRESHOLD:
+        return best_prompt
+
+    with cache.transact():
+        store_to_cache(f"normalized prompt {normalized_prompt}", prompt)
+        for bucket in buckets:
+            bucket_entries = get_from_cache(bucket) or []
+            store_to_cache(bucket, (bucket_entries + [[prompt, list(signature)]])[-SIMILAR_PROMPT_BUCKET_SIZE:])
+    return prompt
+
+def _is_similar_prompt_entry(entry, signature) -> bool:
+    # the buckets written by the previous versions hold only the prompts, their signatures may have been evicted
+    return isinstance(entry, (list, tuple)) and len(entry) == 2 and isinstance(entry[0], str) \
+        and isinstance(entry[1], (list, tuple)) and len(entry[1]) == len(signature)
+
+def _remove_invalid_similar_prompt_entries(buckets, signature):
+    with cache.transact():
+        for bucket in buckets:
+            bucket_entries = get_from_cache(bucket) or []
+            store_to_cache(bucket, [entry for entry in bucket_entries if _is_similar_prompt_entry(entry, signature)])
+
+def _versioned_key(key, version):
+    return f"{key} @{version}"
+
+def _version_index_key(key):
+    return f"version of {key}"
+
+def _user_index_key(user_id):
+    return f"cached values of the user {user_id}"
+
+def _store_to_memory_cache(hashed_key, value):
+    with memory_cache_lock:
+        try:
+            memory_cache[hashed_key] = value
+        except ValueError:
+            # the value is bigger than the whole in-memory cache, it is only kept on the disk
+            memory_cache.pop(hashed_key, None)
 
+@functools.lru_cache(maxsize=4096)
 def key_to_hash(key):
     """
     Hashes the key to create a unique filename.
@@ -1,16 +1,133 @@
+import asyncio
 import json
-from typing import Optional
+import os
+import re
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Optional
 
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.models import LlmResponse, LlmRequest
+from google.adk.tools import BaseTool, ToolContext
 from google.genai.types import Content, Part
 
 
-from mawa.cache import is_cached, get_from_cache
-from mawa.constants import ROOT_PROMPT
-from mawa.utils import _maybe_extract_component_id_from_prompt
+from mawa.cache import CACHE_MISS, get_version_or_miss
+from mawa.metrics import model_call_duration, model_tokens, tool_call_duration
+from mawa.constants import COMPONENT_STORED_AT_PREFIX, COMPONENT_SUB_AGENT_OUTPUT_KEYS, NO_CONTENT, \
+    STYLING_INSTRUCTIONS
+from mawa.utils import _cache_namespace_of_prompt
 
-def load_from_cache(
+# The future of the styling instructions of the request which is being handled, set by the adk_bridge.
+pending_styling_instructions: ContextVar[Optional[asyncio.Future]] = ContextVar("pending_styling_instructions",
+                                                                                default=None)
+
+
+# The future of the version of the cache entry of the request which is being handled, set by the adk_bridge.
+pending_cache_version: ContextVar[Optional[asyncio.Future]] = ContextVar("pending_cache_version", default=None)
+
+# The key of the cache entry of the request which is being handled, set by the adk_bridge.
+pending_cache_key: ContextVar[Optional[str]] = ContextVar("pending_cache_key", default=None)
+
+# The maximal size (in characters) of the prompts of the components injected into the prompt of the main_page_agent.
+# Only the most recent ones fit in, so the prompt does not grow with the number of the components the user has edited.
+MAX_INJECTED_COMPONENT_PROMPTS_SIZE = int(os.getenv("MAX_INJECTED_COMPONENT_PROMPTS_SIZE", "8192"))
+
+# The model and tool calls in progress -> (the model or the tool, the start time).
+# A call which fails never reaches its after callback, so only the most recent calls are kept.
+_calls_in_progress: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+_MAX_CALLS_IN_PROGRESS = 10000
+
+
+async def inject_styling_instructions(callback_context: CallbackContext) -> Optional[Content]:
+    """
+    Stores the styling instructions to the state right before an agent which needs them starts.
+    The style extraction runs concurrently with the rest of the pipeline, so only the agents generating HTML
+    wait for it to finish.
+    """
+    styling_instructions = pending_styling_instructions.get()
+    if styling_instructions is not None and STYLING_INSTRUCTIONS not in callback_context.state:
+        callback_context.state[STYLING_INSTRUCTIONS] = await styling_instructions
+    return None
+
+
+def record_model_call_start(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Starts measuring the model call. Goes after the callbacks which can answer without calling the model,
+    like the load_from_cache, so that only the actual model calls are measured.
+    """
+    _start_call(("model", callback_context.invocation_id, callback_context.agent_name), llm_request.model or "unknown")
+    return None
+
+
+def record_model_call_end(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    Records the duration and the tokens of the model call. Goes before the callbacks which can replace the response,
+    like the clear_technical_response, since the first callback returning a response ends the chain.
+    """
+    if llm_response.partial:
+        return None
+    call = _end_call(("model", callback_context.invocation_id, callback_context.agent_name))
+    if call is None:
+        return None
+
+    model, duration = call
+    model_call_duration.observe(duration, agent=callback_context.agent_name, model=model)
+    usage = llm_response.usage_metadata
+    if usage is not None:
+        for token_type, token_count in [("prompt", usage.prompt_token_count),
+                                        ("completion", usage.candidates_token_count),
+                                        ("thoughts", usage.thoughts_token_count)]:
+            if token_count:
+                model_tokens.inc(token_count, agent=callback_context.agent_name, model=model, type=token_type)
+    return None
+
+
+def record_tool_call_start(tool: BaseTool, args: dict[str, Any], tool_context: ToolContext) -> Optional[dict]:
+    _start_call(("tool", tool_context.invocation_id, tool_context.function_call_id), tool.name)
+    return None
+
+
+def record_tool_call_end(tool: BaseTool, args: dict[str, Any], tool_context: ToolContext,
+                         tool_response: dict) -> Optional[dict]:
+    call = _end_call(("tool", tool_context.invocation_id, tool_context.function_call_id))
+    if call is not None:
+        tool_call_duration.observe(call[1], agent=tool_context.agent_name, tool=tool.name)
+    return None
+
+
+def _start_call(call_key: tuple, name: str):
+    _calls_in_progress[call_key] = (name, time.perf_counter())
+    while len(_calls_in_progress) > _MAX_CALLS_IN_PROGRESS:
+        _calls_in_progress.popitem(last=False)
+
+
+def _end_call(call_key: tuple) -> Optional[tuple[str, float]]:
+    """
+    Returns:
+        The model or the tool and the duration of the call, or None if its start has not been recorded.
+    """
+    call = _calls_in_progress.pop(call_key, None)
+    if call is None:
+        return None
+    name, start = call
+    return name, time.perf_counter() - start
+
+
+def return_single_component_output(callback_context: CallbackContext) -> Optional[Content]:
+    """
+    Skips the component_page_merger_agent if only one of the sub-agents of the component_parallel_sub_agents
+    has generated anything. Its output is the whole component then, so it is returned as it is.
+    """
+    outputs = [callback_context.state.get(key) for key in COMPONENT_SUB_AGENT_OUTPUT_KEYS]
+    generated_outputs = [output for output in outputs if output and output.strip() != NO_CONTENT]
+    if len(generated_outputs) == 1:
+        return Content(role="model", parts=[Part(text=generated_outputs[0])])
+    return None
+
+
+async def load_from_cache(
     callback_context: CallbackContext, llm_request: LlmRequest
 ) -> Optional[LlmResponse]:
     cache_decision_agent_output = callback_context.state.get('cache_decision_agent_output')
@@ -19,14 +136,16 @@ def load_from_cache(
     else:
         return None
 
-    if cache_decision_agent_output == 'CACHE':
-        root_prompt = get_from_cache(ROOT_PROMPT)
-        key = root_prompt + _maybe_extract_component_id_from_prompt(callback_context.user_content.parts[0].text)
-        if is_cached(key):
+    cache_version = pending_cache_version.get()
+    key = pending_cache_key.get()
+    if cache_decision_agent_output == 'CACHE' and cache_version is not None and key is not None:
+        prompt = callback_context.user_content.parts[0].text
+        cached_response = get_version_or_miss(key, await cache_version, _cache_namespace_of_prompt(prompt))
+        if cached_response is not CACHE_MISS:
             cache_response = LlmResponse(
                 content=Content(
                     role="model",
-                    parts=[Part(text=get_from_cache(key))],
+                    parts=[Part(text=cached_response)],
                 )
             )
             cache_response.custom_metadata = {'cache_response': True}
@@ -37,6 +156,10 @@ def clear_technical_response(
     callback_context: CallbackContext,
     llm_response: LlmResponse,
 ) -> Optional[LlmResponse]:
+    if llm_response.partial:
+        # the partial chunks are cleaned as a whole by the StreamingResponseCleaner,
+        # stripping each of them would remove the whitespace between the chunks
+        return None
     cleaned_response = llm_response.model_copy(deep=True)
     return clean_response_parts(cleaned_response)
 
@@ -80,6 +203,52 @@ def clean_response_parts(cleaned_response):
     return cleaned_response
 
 
+class StreamingResponseCleaner:
+    """
+    Does the same cleaning as the clean_response_parts, but incrementally, on the chunks of a streamed response.
+    The text which may still turn out to be a part of the code block delimiters or of the trailing whitespace
+    is held back until more chunks arrive or until the stream is flushed.
+    """
+
+    _PREFIXES = ("```html", "```json")
+    _POSSIBLE_SUFFIX = re.compile(r"\s*`{0,3}\s*$")
+
+    def __init__(self):
+        self.started = False
+        self._in_prefix = True
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """
+        Adds the next chunk and returns the part of the cleaned text which is already safe to send.
+        """
+        self.started = True
+        self._pending += text
+
+        if self._in_prefix:
+            self._pending = self._pending.lstrip()
+            if any(prefix.startswith(self._pending) for prefix in self._PREFIXES):
+                # not enough text yet to tell if it is a code block delimiter
+                return ""
+            for prefix in self._PREFIXES:
+                self._pending = self._pending.removeprefix(prefix)
+            self._in_prefix = False
+
+        safe_length = self._POSSIBLE_SUFFIX.search(self._pending).start()
+        ready, self._pending = self._pending[:safe_length], self._pending[safe_length:]
+        return ready
+
+    def flush(self) -> str:
+        """
+        Returns the rest of the cleaned text once the stream has ended.
+        """
+        rest = self._pending.rstrip()
+        self._pending = ""
+        if self._in_prefix:
+            rest = rest.strip()
+        return rest.removesuffix("```")
+
+
 def inject_stored_component_ids(
     callback_context: CallbackContext, llm_request: LlmRequest
 ) -> Optional[LlmResponse]:
@@ -104,6 +273,7 @@ def inject_stored_component_ids(
 def filter_component_keys(data_dict):
     """
     Filters keys starting with 'user:component' from a dictionary and formats them into a JSON string.
+    Only the most recently stored components fitting into the MAX_INJECTED_COMPONENT_PROMPTS_SIZE are included.
 
     Args:
         data_dict (dict): Dictionary containing keys and values
@@ -113,15 +283,25 @@ def filter_component_keys(data_dict):
     """
 
     components = []
+    size = 0
 
-    for key, value in data_dict.items():
-        if key.startswith('user:component'):
-            component_name = key.replace('user:', '')
-            components.append({
-                'componentId': component_name,
-                'bodyValue': value
-            })
+    # the state keeps the keys in the order they have first been stored in, a re-stored key keeps its position,
+    # so the components are ordered by the time they have last been stored at. The ones stored without the time
+    # count as the oldest, in the order of the state.
+    component_keys = sorted(
+        (key for key in reversed(list(data_dict)) if key.startswith('user:component')),
+        key=lambda key: data_dict.get(f"user:{COMPONENT_STORED_AT_PREFIX}{key.replace('user:', '')}", 0),
+        reverse=True)
+    for key in component_keys:
+        component_name = key.replace('user:', '')
+        size += len(component_name) + len(str(data_dict[key]))
+        if size > MAX_INJECTED_COMPONENT_PROMPTS_SIZE:
+            break
+        components.append({
+            'componentId': component_name,
+            'bodyValue': data_dict[key]
+        })
 
-    result = json.dumps(components)
+    result = json.dumps(components[::-1])
 
     return result
\ No newline at end of file
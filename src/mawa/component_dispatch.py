@@ -0,0 +1,75 @@
+import asyncio
+from typing import AsyncGenerator
+
+from google.adk.agents import BaseAgent, ParallelAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+from mawa.constants import NO_CONTENT
+from mawa.request_classifier import select_component_agents
+
+
+class ComponentDispatcher(ParallelAgent):
+    """
+    Runs in parallel only those of its sub-agents the prompt of the component needs, see select_component_agents.
+    The outputs of the sub-agents which are not run are set to NO_CONTENT, as if they had nothing to generate.
+    If the prompt is not recognized, all the sub-agents run.
+    """
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        prompt = ctx.user_content.parts[0].text if ctx.user_content and ctx.user_content.parts else ""
+        selected_agent_names = select_component_agents(prompt or "")
+        if selected_agent_names is None:
+            selected_agents = self.sub_agents
+        else:
+            selected_agents = [sub_agent for sub_agent in self.sub_agents if sub_agent.name in selected_agent_names]
+        skipped_outputs = {
+            sub_agent.output_key: NO_CONTENT
+            for sub_agent in self.sub_agents
+            if sub_agent not in selected_agents and getattr(sub_agent, "output_key", None)
+        }
+        if skipped_outputs:
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                actions=EventActions(state_delta=skipped_outputs),
+            )
+
+        agent_runs = [sub_agent.run_async(self._branch_context(sub_agent, ctx)) for sub_agent in selected_agents]
+        async for event in _merge_event_streams(agent_runs):
+            yield event
+
+    def _branch_context(self, sub_agent: BaseAgent, ctx: InvocationContext) -> InvocationContext:
+        """
+        The context of the sub-agent, in its own branch, so that the sub-agents do not see each other's events.
+        The same branch the ParallelAgent would create, so the events look the same.
+        """
+        branch_suffix = f"{self.name}.{sub_agent.name}"
+        return ctx.model_copy(update={"branch": f"{ctx.branch}.{branch_suffix}" if ctx.branch else branch_suffix})
+
+
+async def _merge_event_streams(agent_runs: list[AsyncGenerator[Event, None]]) -> AsyncGenerator[Event, None]:
+    """
+    Yields the events of all the runs as they come. Each run is resumed only once its previous event has been
+    processed by the caller (e.g. its state delta has been applied by the runner).
+    """
+    next_events = {asyncio.ensure_future(agent_run.__anext__()): agent_run for agent_run in agent_runs}
+    try:
+        while next_events:
+            done, _ = await asyncio.wait(next_events, return_when=asyncio.FIRST_COMPLETED)
+            for next_event in done:
+                agent_run = next_events.pop(next_event)
+                try:
+                    event = next_event.result()
+                except StopAsyncIteration:
+                    continue
+                yield event
+                next_events[asyncio.ensure_future(agent_run.__anext__())] = agent_run
+    finally:
+        # the caller has stopped reading the events, or one of the runs has failed
+        for next_event in next_events:
+            next_event.cancel()
+        await asyncio.gather(*next_events, return_exceptions=True)
+        for agent_run in agent_runs:
+            await agent_run.aclose()
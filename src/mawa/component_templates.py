@@ -0,0 +1,106 @@
+import functools
+import os
+import re
+from typing import NamedTuple, Optional
+
+from mawa.data_access import load_data_directly
+
+# If enabled, the tables and charts are generated as templates with the data left out. The template is cached
+# and rendered with the current data on each request, so the new matches do not need any model call.
+COMPONENT_TEMPLATES = os.getenv("COMPONENT_TEMPLATES", "false").lower() == "true"
+
+# What the template has in place of the data.
+DATA_PLACEHOLDER = "__MAWA_DATA__"
+# The attribute of the <script type="application/json"> with the "load data" request the data are loaded by.
+DATA_REQUEST_ATTRIBUTE = "data-mawa-data-request"
+
+_DATA_REQUEST_PATTERN = re.compile(
+    rf"<script\b[^>]*\b{DATA_REQUEST_ATTRIBUTE}\b[^>]*>(.*?)</script\s*>", re.IGNORECASE | re.DOTALL)
+
+
+class CompiledTemplate(NamedTuple):
+    # the template split by the placeholders, there is one more segment than there are placeholders
+    segments: list[str]
+    # the "load data" request of each placeholder, None if the placeholder is not preceded by any
+    data_requests: list[Optional[str]]
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    """
+    Splits the template by the DATA_PLACEHOLDERs and pairs each of them with the closest data request before it.
+    """
+    data_requests = [(match.end(), match.group(1).strip()) for match in _DATA_REQUEST_PATTERN.finditer(template)]
+    segments = []
+    placeholder_requests = []
+    position = 0
+    while (placeholder_start := template.find(DATA_PLACEHOLDER, position)) != -1:
+        segments.append(template[position:placeholder_start])
+        preceding_requests = [request for request_end, request in data_requests if request_end <= placeholder_start]
+        placeholder_requests.append(preceding_requests[-1] if preceding_requests else None)
+        position = placeholder_start + len(DATA_PLACEHOLDER)
+    segments.append(template[position:])
+    return CompiledTemplate(segments, placeholder_requests)
+
+
+def render_template(template: str) -> str:
+    """
+    Replaces the DATA_PLACEHOLDERs of the template by the current data, loaded without any agent
+    (see load_data_directly). The placeholders whose data can not be loaded that way are replaced by null,
+    the component loads them from the /api itself. A template without placeholders is returned as it is.
+    """
+    compiled_template = compile_template(template)
+    if not compiled_template.data_requests:
+        return template
+
+    loaded_data = {}
+    parts = [compiled_template.segments[0]]
+    for data_request, segment in zip(compiled_template.data_requests, compiled_template.segments[1:]):
+        if data_request not in loaded_data:
+            loaded_data[data_request] = _load_data(data_request)
+        parts.append(loaded_data[data_request])
+        parts.append(segment)
+    return "".join(parts)
+
+
+def _load_data(data_request: Optional[str]) -> str:
+    data = load_data_directly(data_request) if data_request else None
+    if data is None:
+        return "null"
+    # the data are inside of a <script>, which must not be closed by any of the values
+    return data.replace("</", "<\\/").replace("<!--", "<\\!--")
+
+
+def data_loading_instructions(visualization: str) -> str:
+    """
+    The part of the instructions of the visualization agents (e.g. the table) telling them where to get the data from.
+    """
+    if not COMPONENT_TEMPLATES:
+        return f"""
+                ### Data Loading:
+                    - Data MUST be loaded asynchronously via a `POST` request to the `/api` endpoint. 
+                    - Generate a <script> tag which uses XHR to load the data.
+                    - Make sure this script will call the server right after this component is done rendering.
+                    - Never add an ADD button to the component. 
+                    - Add a reload button. If clicked, the same server call will be executed loading the data again.
+                    - The `POST` request body MUST be a JSON object specifying:
+                        - `request`: "load data",
+                        - `source`: (string) The origin or identifier of the data.
+                        - `format`: (string) The desired data format (e.g., 'JSON', 'CSV').
+                        - `output_format`: (object) The output structure the {visualization} generated by you can process. For instance, to get a list of users, the structure would be `[{{'name': 'userName', 'age': 'userAge'}}]`.
+                    - While data is loading, display a prominent loading indicator within the {visualization} structure."""
+    return f"""
+                ### Data Loading:
+                    - The data are filled in by the server, you never see them. Generate a template the server renders with any data.
+                    - Generate a <script type="application/json" {DATA_REQUEST_ATTRIBUTE}> tag containing only the JSON request body described below.
+                    - Right after it, generate a <script> tag reading the data exactly like this: `const initialData = {DATA_PLACEHOLDER};`.
+                    - Write the {DATA_PLACEHOLDER} exactly as it is, never in quotes. The server replaces it by the JSON array of the data, or by null.
+                    - Show the initialData in the {visualization} right away. If it is null, load the data by the `POST` request to the `/api` endpoint instead.
+                    - Never add an ADD button to the component.
+                    - Add a reload button. If clicked, the data are loaded again via a `POST` request to the `/api` endpoint using XHR, with the request body from the {DATA_REQUEST_ATTRIBUTE} tag.
+                    - The request body MUST be a JSON object specifying:
+                        - `request`: "load data",
+                        - `source`: (string) The origin or identifier of the data.
+                        - `format`: "JSON".
+                        - `output_format`: (object) The output structure the {visualization} generated by you can process. For instance, to get a list of users, the structure would be `[{{"name": "userName", "age": "userAge"}}]`.
+                    - While data is loading, display a prominent loading indicator within the {visualization} structure."""
@@ -1,6 +1,7 @@
 # This file contains constants which can be considered a form of an API - a way how agents or callbacks can access data added to state by the orchestrator code.
 
-# The prompt which is in the URL. For example, in "localhost:8000/a page in calming style" it would be "a page in calming style".
+# Will be stored in the session and contain the prompt which is in the URL of the page the request belongs to.
+# For example, in "localhost:8000/a page in calming style" it would be "a page in calming style".
 ROOT_PROMPT = "root_prompt"
 
 # Will be stored in the session and contain instructions for components on how to style themselves.
@@ -8,4 +9,18 @@ STYLING_INSTRUCTIONS = "styling_instructions"
 
 # Will be stored in the session and contain the hash of the prompt which is now being handled.
 # It can be used for cache invalidation.
-CURRENT_PROMPT_HASH = "current_prompt_hash"
\ No newline at end of file
+CURRENT_PROMPT_HASH = "current_prompt_hash"
+
+# Will be stored per user, followed by the id of a component, and contain the time (time.time()) the prompt
+# of the component has last been stored. The prompts stored most recently are injected into the page first.
+COMPONENT_STORED_AT_PREFIX = "stored_at:"
+
+# Returned by the sub-agents of the component_parallel_sub_agents which have nothing to generate for the prompt.
+NO_CONTENT = "NO_CONTENT"
+
+# The state entries the sub-agents of the component_parallel_sub_agents store their outputs to.
+COMPONENT_SUB_AGENT_OUTPUT_KEYS = [
+    "tabular_data_visualization_agent_output",
+    "chart_data_visualization_agent_output",
+    "add_data_agent_output",
+]
@@ -0,0 +1,219 @@
+import inspect
+import json
+import re
+from typing import Optional
+
+from mawa_mcp_server.data_provider import add_match, get_leagues, get_matches
+from mawa.request_classifier import parse_structured_prompt
+
+# Words the generated components use in the output_format to refer to the fields of a match.
+_SCORE_WORDS = {"score", "scores", "goal", "goals", "point", "points", "result"}
+_PLAYER_WORDS = {"player", "name", "user", "username", "playername", "home", "away", "guest"}
+_FIRST_WORDS = {"1", "one", "first", "home"}
+_SECOND_WORDS = {"2", "two", "second", "away", "guest"}
+
+
+def load_data_directly(prompt: str) -> Optional[str]:
+    """
+    Handles the "load data" requests of the tables and charts without the data_loader_agent.
+    Loads the matches and projects them into the output_format requested by the component.
+
+    Args:
+        prompt: The "load data" request as sent by the component. For example:
+            {
+                "request": "load data",
+                "source": "matches_database",
+                "format": "JSON",
+                "output_format": [{"name": "player1", "score": "player1_score"}]
+            }
+
+    Returns:
+        The JSON array with the projected matches or None if the request can not be handled
+        deterministically and has to be passed to the data_loader_agent.
+    """
+    request = parse_structured_prompt(prompt)
+    if request is None or str(request.get('request', '')).strip().lower() != 'load data':
+        return None
+
+    if str(request.get('format', 'JSON')).strip().upper() != 'JSON':
+        return None
+
+    mapping = _resolve_output_format(request.get('output_format'))
+    if mapping is None:
+        return None
+
+    matches = _load_matches(request)
+    if matches is None:
+        return None
+
+    return json.dumps([
+        {output_key: match.get(match_field) for output_key, match_field in mapping.items()}
+        for match in matches
+    ])
+
+
+def save_match_directly(prompt: str) -> Optional[str]:
+    """
+    Handles the "create a new match: {...}" requests of the add match forms without the data_saver_agent.
+    Validates the JSON against the signature of the add_match tool, coerces the types and calls the tool.
+
+    Args:
+        prompt: The request as sent by the form. For example:
+            create a new match: {"league": "Brno", "player1": "Pecene", "player1_score": "10", ...}
+
+    Returns:
+        The same JSON the data_saver_agent would return, e.g. {"status": "success"},
+        or None if the JSON can not be parsed and the request has to be passed to the data_saver_agent.
+    """
+    json_start = prompt.find('{')
+    if json_start == -1:
+        return None
+    payload = parse_structured_prompt(prompt[json_start:])
+    if payload is None:
+        return None
+
+    # the form may name the fields a bit differently, e.g. "player1Score"
+    values = {}
+    for key, value in payload.items():
+        values.setdefault(key, value)
+        match_field = _resolve_match_field(_words(str(key)))
+        if match_field is not None:
+            values.setdefault(match_field, value)
+
+    arguments = {}
+    for name, parameter in inspect.signature(add_match).parameters.items():
+        if name not in values:
+            return _save_error(f"the provided parameters can not be translated to the tool add_match: missing '{name}'")
+        argument = _coerce(values[name], parameter.annotation)
+        if argument is None:
+            return _save_error(f"the provided parameters can not be translated to the tool add_match: "
+                               f"invalid value of '{name}': '{values[name]}'")
+        arguments[name] = argument
+
+    result = add_match(**arguments)
+    if result.get('status') != 'success':
+        return _save_error(result.get('error_message', 'Unknown error.'))
+    return json.dumps({"status": "success"})
+
+
+def _coerce(value, annotation):
+    """
+    Converts the value sent by the form to the type the tool expects, e.g. "10" to 10.
+
+    Returns:
+        The converted value or None if it can not be converted.
+    """
+    if annotation is int:
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            return None
+
+    value = str(value).strip() if value is not None else ""
+    return value or None
+
+
+def _save_error(message: str) -> str:
+    return json.dumps({"status": "error", "message": message})
+
+
+def _load_matches(request: dict) -> Optional[list[dict]]:
+    """
+    Loads the matches of the league the request refers to, either explicitly by the 'league' property,
+    or by mentioning the league in the 'source'.
+
+    Returns:
+        The matches or None if no league is mentioned, the data_loader_agent has to find out which one is meant.
+    """
+    if 'league' in request:
+        leagues = [str(request['league'])]
+    else:
+        source = _normalize(str(request.get('source', '')))
+        leagues = [league for league in get_leagues() if _normalize(league) in source]
+        if not leagues:
+            return None
+
+    matches = []
+    for league in leagues:
+        result = get_matches(league)
+        if result.get('status') != 'success':
+            return None
+        matches.extend({**match, 'league': league} for match in result['users'])
+    return matches
+
+
+def _resolve_output_format(output_format) -> Optional[dict[str, str]]:
+    """
+    Maps the keys of the requested output_format onto the fields of a match.
+
+    Returns:
+        A dict of output key -> match field, or None if any of the keys can not be mapped.
+    """
+    if isinstance(output_format, list) and output_format:
+        output_format = output_format[0]
+    if not isinstance(output_format, dict) or not output_format:
+        return None
+
+    mapping = {}
+    for key, example_value in output_format.items():
+        key_words = _words(str(key))
+        match_field = _resolve_match_field(key_words)
+        if match_field is None and isinstance(example_value, str):
+            # examples like {"score": "player1_score"} name the field themselves
+            match_field = _resolve_match_field(_words(example_value))
+        if match_field is None and isinstance(example_value, str) and _is_player_name_key(key_words):
+            # examples like {"name": "userName1"} tell which player the key refers to
+            match_field = _resolve_match_field(key_words + [word for word in _words(example_value) if word.isdigit()])
+        if match_field is None:
+            return None
+        mapping[key] = match_field
+    return mapping
+
+
+def _resolve_match_field(words: list[str]) -> Optional[str]:
+    word_set = set(words)
+    if word_set & _FIRST_WORDS and word_set & _SECOND_WORDS:
+        # e.g. "3-1", it is not clear which player is meant
+        return None
+    if word_set & _FIRST_WORDS:
+        player = "player1"
+    elif word_set & _SECOND_WORDS:
+        player = "player2"
+    else:
+        player = None
+
+    if word_set & _SCORE_WORDS:
+        return f"{player}_score" if player else None
+    if "league" in word_set:
+        return "league"
+    if word_set & _PLAYER_WORDS:
+        return player
+    if "id" in word_set:
+        return "id"
+    return None
+
+
+def _is_player_name_key(key_words: list[str]) -> bool:
+    """
+    Whether the key names a player, e.g. "name", but not the score of one, e.g. "score" with the example "3-1".
+    """
+    word_set = set(key_words)
+    return bool(word_set & _PLAYER_WORDS) and not word_set & _SCORE_WORDS
+
+
+def _words(text: str) -> list[str]:
+    """
+    Splits identifiers like "player1Score", "player_1_score" or "Player 1 score" into lowercase words.
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return re.findall(r"[a-z]+|\d+", text.lower())
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace(" ", "")
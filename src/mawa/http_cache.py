@@ -0,0 +1,103 @@
+import functools
+import gzip
+import hashlib
+import os
+import threading
+
+from cachetools import LRUCache
+from starlette.requests import Request
+from starlette.responses import Response
+
+# The size (in bytes) of the in-memory cache of the compressed response bodies.
+HTTP_BODY_CACHE_SIZE = int(os.getenv("HTTP_BODY_CACHE_SIZE", str(16 * 1024 * 1024)))
+# How long (in seconds) the browsers keep the static files (e.g. the index.html) without asking the server again.
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+
+# The generated pages may change any time (an edit, new data), so the browser has to revalidate them by the ETag.
+GENERATED_CACHE_CONTROL = "no-cache"
+# The responses of the POST requests are not stored anywhere.
+API_CACHE_CONTROL = "no-store"
+STATIC_CACHE_CONTROL = f"public, max-age={STATIC_MAX_AGE}"
+
+# The bodies smaller than this are sent uncompressed, gzip would not make them any smaller.
+_MIN_COMPRESSED_SIZE = 1024
+
+# ETag -> the gzipped body, so that the bodies served repeatedly are compressed only once
+_compressed_bodies = LRUCache(maxsize=HTTP_BODY_CACHE_SIZE, getsizeof=len)
+_compressed_bodies_lock = threading.Lock()
+
+
+def cached_response(request: Request, body: str | bytes, media_type: str, cache_control: str) -> Response:
+    """
+    Creates the response with a strong ETag of the body. Answers 304 Not Modified if the browser already has the body
+    (If-None-Match) and sends the body gzipped if the browser accepts it. The gzipped body is a different
+    representation, so it has its own ETag (with the -gzip suffix), both of them are accepted by the If-None-Match.
+
+    Args:
+        request: The request the response is for
+        body: The complete body of the response
+        media_type: The media type of the body, e.g. text/html
+        cache_control: The Cache-Control header, e.g. the GENERATED_CACHE_CONTROL
+    """
+    raw_body = body.encode("utf-8") if isinstance(body, str) else body
+    body_hash = hashlib.sha256(raw_body).hexdigest()
+    identity_etag = f'"{body_hash}"'
+    gzip_etag = f'"{body_hash}-gzip"'
+    gzipped = len(raw_body) >= _MIN_COMPRESSED_SIZE and _accepts_gzip(request.headers.get("accept-encoding", ""))
+    etag = gzip_etag if gzipped else identity_etag
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if request.method in ("GET", "HEAD"):
+        matching_etag = _matching_etag(request.headers.get("if-none-match"), etag, (identity_etag, gzip_etag))
+        if matching_etag is not None:
+            # the 304 confirms the representation the browser has
+            return Response(status_code=304, headers={**headers, "ETag": matching_etag})
+
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(_compress(etag, raw_body), media_type=media_type, headers=headers)
+    return Response(raw_body, media_type=media_type, headers=headers)
+
+
+@functools.cache
+def read_static_file(path: str) -> bytes:
+    """
+    Reads the static file only once, it is served from the memory afterwards.
+    """
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _compress(etag: str, raw_body: bytes) -> bytes:
+    with _compressed_bodies_lock:
+        compressed_body = _compressed_bodies.get(etag)
+    if compressed_body is None:
+        compressed_body = gzip.compress(raw_body, compresslevel=6, mtime=0)
+        with _compressed_bodies_lock:
+            _compressed_bodies[etag] = compressed_body
+    return compressed_body
+
+
+def _matching_etag(if_none_match: str | None, etag: str, body_etags: tuple[str, ...]) -> str | None:
+    """
+    Returns:
+        The ETag of the If-None-Match which is one of the body_etags (the etag for "*"), None if there is none.
+    """
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    for candidate in if_none_match.split(","):
+        # the weak comparison, as the If-None-Match requires, e.g. a proxy may have compressed the body itself
+        candidate = candidate.strip().removeprefix("W/")
+        if candidate in body_etags:
+            return candidate
+    return None
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.lower().split(","):
+        name, _, parameters = coding.strip().partition(";")
+        if name.strip() in ("gzip", "*"):
+            return parameters.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,155 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from itertools import count
+from typing import AsyncGenerator, Optional
+
+from google.adk.models import BaseLlm, Gemini, LlmRequest, LlmResponse, LLMRegistry
+
+logger = logging.getLogger(__name__)
+
+# "record" stores each model call to the LLM_CASSETTE_FILE, "replay" answers the model calls from it without
+# calling the models, e.g. for the load tests. Any other value calls the models as usual.
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_FILE = os.getenv("LLM_CASSETTE_FILE", "llm_cassette.jsonl.gz")
+# Multiplies the recorded latencies the replayed responses are delayed by, 0 replays them right away.
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1"))
+
+_cassette_lock = threading.Lock()
+
+
+class CassetteMiss(Exception):
+    """Raised in the replay mode for a model call which has not been recorded."""
+
+
+def install_llm_cassette():
+    """
+    Makes the gemini-* models of the agents record to or replay from the cassette, according to the LLM_CASSETTE_MODE.
+    Has to be called before the agents call the models.
+    """
+    if LLM_CASSETTE_MODE == "record":
+        llm_class = RecordingGemini
+    elif LLM_CASSETTE_MODE == "replay":
+        ReplayLlm.load(LLM_CASSETTE_FILE)
+        llm_class = ReplayLlm
+    else:
+        return
+    register_llm(llm_class)
+    logger.info("The model calls are %sed, the cassette is %s", LLM_CASSETTE_MODE, LLM_CASSETTE_FILE)
+
+
+def register_llm(llm_class: type[BaseLlm]):
+    """
+    Makes the models matching the supported_models of the class (e.g. gemini-.*) resolve to it,
+    replacing the class they have been resolved to before.
+    """
+    LLMRegistry.register(llm_class)
+    # the resolved models are cached
+    LLMRegistry.resolve.cache_clear()
+
+
+def llm_request_key(model: str, llm_request: LlmRequest) -> str:
+    """
+    The key of the model call in the cassette, a hash of the model, the system instruction and the contents.
+    The ids of the function calls and responses are left out, they are different in each session.
+    """
+    contents = [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents]
+    for content in contents:
+        for part in content.get("parts", []):
+            for function_part in ("function_call", "function_response"):
+                if function_part in part:
+                    part[function_part].pop("id", None)
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    if instruction is not None and not isinstance(instruction, str):
+        instruction = instruction.model_dump(mode="json", exclude_none=True)
+    key = json.dumps({"model": model, "instruction": instruction, "contents": contents}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class RecordingGemini(Gemini):
+    """
+    Calls the Gemini and appends each completed call to the LLM_CASSETTE_FILE, as a gzipped JSON line with the key
+    of the request, its responses and when each of them arrived.
+    """
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        key = llm_request_key(llm_request.model or self.model, llm_request)
+        start = time.monotonic()
+        responses = []
+        offsets = []
+        try:
+            async for llm_response in super().generate_content_async(llm_request, stream):
+                responses.append(llm_response.model_dump(mode="json", exclude_none=True))
+                offsets.append(time.monotonic() - start)
+                yield llm_response
+        except GeneratorExit:
+            # ADK stops reading the responses once it has got the complete one, e.g. a transfer to another agent
+            if responses and not responses[-1].get("partial"):
+                self._record(llm_request, key, offsets, responses)
+            raise
+        self._record(llm_request, key, offsets, responses)
+
+    def _record(self, llm_request: LlmRequest, key: str, offsets: list[float], responses: list[dict]):
+        record = {
+            "key": key,
+            "model": llm_request.model or self.model,
+            "agent": (llm_request.config.labels or {}).get("adk_agent_name") if llm_request.config else None,
+            "latency": offsets[-1] if offsets else 0.0,
+            "offsets": offsets,
+            "responses": responses,
+        }
+        # each record is a separate gzip member, so the file stays readable if the recording is interrupted
+        with _cassette_lock, gzip.open(LLM_CASSETTE_FILE, "ab") as cassette:
+            cassette.write((json.dumps(record) + "\n").encode())
+
+
+class ReplayLlm(BaseLlm):
+    """
+    Answers the model calls by the responses recorded by the RecordingGemini, delayed as they were recorded
+    (scaled by the LLM_REPLAY_LATENCY_SCALE). The calls recorded several times are answered by the recordings in turn.
+    """
+
+    _records: dict[str, list[dict]] = {}
+    _replay_counts: dict[str, count] = {}
+
+    @staticmethod
+    def supported_models() -> list[str]:
+        return [r"gemini-.*"]
+
+    @classmethod
+    def load(cls, file: str):
+        records = {}
+        with gzip.open(file, "rt") as cassette:
+            for line in cassette:
+                if line.strip():
+                    record = json.loads(line)
+                    records.setdefault(record["key"], []).append(record)
+        cls._records = records
+        cls._replay_counts = {key: count() for key in records}
+        logger.info("Loaded %d recorded model calls from %s", sum(map(len, records.values())), file)
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        record = self._next_record(llm_request_key(llm_request.model or self.model, llm_request))
+        if record is None:
+            agent_name = (llm_request.config.labels or {}).get("adk_agent_name") if llm_request.config else None
+            raise CassetteMiss(f"The model call of the {agent_name} has not been recorded in {LLM_CASSETTE_FILE}")
+
+        start = time.monotonic()
+        for offset, response in zip(record["offsets"], record["responses"]):
+            delay = offset * LLM_REPLAY_LATENCY_SCALE - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield LlmResponse.model_validate(response)
+
+    def _next_record(self, key: str) -> Optional[dict]:
+        records = self._records.get(key)
+        if not records:
+            return None
+        return records[next(self._replay_counts[key]) % len(records)]
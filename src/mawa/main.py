@@ -1,40 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import quote, unquote, urlsplit
+
 from fastapi import FastAPI, Request, Response
 from google import genai
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 
-from mawa.adk_bridge import run_root_agent, run_style_extraction_agent
-from mawa.cache import store_to_cache, get_from_cache
-from mawa.constants import ROOT_PROMPT
+from mawa.admission import ModelOverloaded
+from mawa.adk_bridge import build_runners, run_root_agent, start_style_extraction, stream_root_agent
+from mawa.agent import start_data_provider, stop_data_provider
+from mawa.revalidation import stop_revalidation_workers
+from mawa.sessions import TooManySessions
+from mawa.cache import resolve_similar_prompt
+from mawa.http_cache import API_CACHE_CONTROL, GENERATED_CACHE_CONTROL, STATIC_CACHE_CONTROL, cached_response, \
+    read_static_file
+from mawa.metrics import render_metrics
+from mawa.page_assembly import find_component_placeholders, inline_components
+from mawa.request_classifier import CACHE, classify_request, parse_structured_prompt
+from mawa.single_flight import SingleFlightCancelled
+from mawa.utils import _maybe_extract_component_id_from_prompt
 
 FOOTBALL_FAVICON_SVG = """<svg xmlns="[http://www.w3.org/2000/svg](http://www.w3.org/2000/svg)" viewBox="0 0 100 100">
   <circle cx="50" cy="50" r="48" fill="#FFFFFF"/> <polygon points="50,25 70,40 60,70 40,70 30,40" fill="#000000"/> </svg>"""
 
-USER_NAME = "hardcoded_username"
+# The user is identified by the header (e.g. set by an authenticating proxy), or by the cookie the server sets
+# on the first visit of the browser.
+USER_HEADER = "X-Mawa-User"
+USER_COOKIE = "mawa_user"
+_USER_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+_USER_ID_PATTERN = re.compile(r"[A-Za-z0-9_.@-]{1,64}")
+
+# The cookie with the prompt of the page the browser has loaded last, for the /api requests sent without the Referer.
+ROOT_PROMPT_COOKIE = "mawa_root_prompt"
+
+# If enabled, the generated HTML is sent to the browser as the model produces it.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+# The maximal number of the components resolved by one /api/batch request.
+MAX_BATCH_COMPONENTS = int(os.getenv("MAX_BATCH_COMPONENTS", "32"))
+# If enabled, the components of the page are inlined into it by the server, instead of being loaded by the browser.
+# Only applies if the responses are not streamed.
+SERVER_SIDE_RENDERING = os.getenv("SERVER_SIDE_RENDERING", "true").lower() == "true"
+# How long (in seconds) the page waits for its components, the ones not resolved by then are loaded by the browser.
+SERVER_SIDE_RENDERING_DEADLINE = float(os.getenv("SERVER_SIDE_RENDERING_DEADLINE", "2"))
+
+# the component generations which have outlived the page they have been started for
+_background_resolutions: set[asyncio.Task] = set()
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    build_runners()
+    await start_data_provider()
+    yield
+    await stop_revalidation_workers()
+    await stop_data_provider()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 client = genai.Client()
 
+@app.exception_handler(asyncio.TimeoutError)
+async def handle_timeout(request: Request, exc: asyncio.TimeoutError):
+    return HTMLResponse("The page is still being generated, please try again later.", status_code=504)
+
+@app.exception_handler(ModelOverloaded)
+async def handle_overloaded_model(request: Request, exc: ModelOverloaded):
+    return HTMLResponse("The server is busy generating other pages, please try again later.", status_code=503,
+                        headers={"Retry-After": "5"})
+
+@app.exception_handler(TooManySessions)
+async def handle_too_many_sessions(request: Request, exc: TooManySessions):
+    return HTMLResponse("The server is handling too many requests, please try again later.", status_code=503,
+                        headers={"Retry-After": "5"})
+
+@app.exception_handler(SingleFlightCancelled)
+async def handle_cancelled_generation(request: Request, exc: SingleFlightCancelled):
+    return HTMLResponse("The generation of the page has been interrupted, please try again.", status_code=503)
+
 @app.get("/", response_class=HTMLResponse)
-async def serve_homepage():
-    with open("static/index.html", "r") as file:
-        html_content = file.read()
-    return HTMLResponse(content=html_content, status_code=200)
+async def serve_homepage(request: Request):
+    return cached_response(request, read_static_file("static/index.html"), "text/html", STATIC_CACHE_CONTROL)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    The metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.post("/api", response_class=HTMLResponse)
 async def api(request: Request):
-    body = await request.body()
+    prompt = (await request.body()).decode("utf-8")
+    root_prompt = _request_root_prompt(request)
+    if root_prompt is None and _maybe_extract_component_id_from_prompt(prompt) != prompt:
+        return HTMLResponse("The page of the component is not known, load the page first.", status_code=400)
+
+    user_id, new_user = _request_user_id(request)
+    response = await _run_mawa(request, user_id, prompt, root_prompt or "", API_CACHE_CONTROL)
+    return _remember_user(response, user_id, new_user)
+
+@app.post("/api/batch")
+async def api_batch(request: Request):
+    """
+    Resolves all the components of a page in one request. The body is a JSON list of the bodies the /api accepts.
+    The response maps the id of each component to {"html": ...} or {"error": ...}. If the client accepts
+    application/x-ndjson, each component is sent as a separate line with its "id" as soon as it is resolved instead.
+    """
+    try:
+        components = json.loads(await request.body())
+    except json.JSONDecodeError:
+        components = None
+    if not isinstance(components, list) or len(components) > MAX_BATCH_COMPONENTS:
+        return JSONResponse({"error": f"The body must be a JSON list of at most {MAX_BATCH_COMPONENTS} components."},
+                            status_code=400)
+    streamed = "application/x-ndjson" in request.headers.get("accept", "")
+    if not components:
+        # nothing to resolve, so neither the page nor its styling are needed
+        return Response(media_type="application/x-ndjson") if streamed else JSONResponse({})
+    root_prompt = _request_root_prompt(request)
+    if root_prompt is None:
+        return JSONResponse({"error": "The page of the components is not known, load the page first."},
+                            status_code=400)
 
-    return await _run_mawa(USER_NAME, body.decode("utf-8"))
+    user_id, new_user = _request_user_id(request)
+    results = _resolve_components(user_id, components, root_prompt)
+    if streamed:
+        response = StreamingResponse((json.dumps(result) + "\n" async for result in results),
+                                     media_type="application/x-ndjson")
+    else:
+        response = cached_response(request, json.dumps({result.pop("id"): result async for result in results}),
+                                   "application/json", API_CACHE_CONTROL)
+    return _remember_user(response, user_id, new_user)
 
 
 @app.get("/{root_prompt}", response_class=HTMLResponse)
-async def root(root_prompt: str):
+async def root(request: Request, root_prompt: str):
     if root_prompt == "favicon.ico":
-        return Response(content=FOOTBALL_FAVICON_SVG, media_type="image/svg+xml")
+        return cached_response(request, FOOTBALL_FAVICON_SVG, "image/svg+xml", STATIC_CACHE_CONTROL)
+
+    # trivially different URLs share the generations
+    root_prompt = resolve_similar_prompt(root_prompt)
+    user_id, new_user = _request_user_id(request)
+    if SERVER_SIDE_RENDERING and not STREAM_RESPONSES:
+        response = cached_response(request, await _render_page(user_id, root_prompt), "text/html",
+                                   GENERATED_CACHE_CONTROL)
+    else:
+        response = await _run_mawa(request, user_id, root_prompt, root_prompt, GENERATED_CACHE_CONTROL)
+    response.set_cookie(ROOT_PROMPT_COOKIE, quote(root_prompt, safe=""), httponly=True, samesite="lax")
+    return _remember_user(response, user_id, new_user)
+
+def _request_user_id(request: Request) -> tuple[str, bool]:
+    """
+    Identifies the user by the USER_HEADER or the USER_COOKIE. The components the user edits, the user: state
+    and the cache quota all belong to this id.
+
+    Returns:
+        The id and True if the user has not been identified, so a new id has been created for the cookie.
+    """
+    for user_id in (request.headers.get(USER_HEADER), request.cookies.get(USER_COOKIE)):
+        if user_id and _USER_ID_PATTERN.fullmatch(user_id):
+            return user_id, False
+    return uuid.uuid4().hex, True
+
+def _remember_user(response: Response, user_id: str, new_user: bool) -> Response:
+    if new_user:
+        response.set_cookie(USER_COOKIE, user_id, max_age=_USER_COOKIE_MAX_AGE, httponly=True, samesite="lax")
+    return response
+
+def _request_root_prompt(request: Request):
+    """
+    The prompt of the page an /api request has been sent from, taken from the URL of the page in the Referer,
+    or from the cookie set by the page the browser has loaded last. Each request carries it, so it does not matter
+    which worker handles the request.
+
+    Returns:
+        The prompt or None if the request does not tell.
+    """
+    referer_path = urlsplit(request.headers.get("referer", "")).path.lstrip("/")
+    if referer_path and referer_path != "favicon.ico":
+        return resolve_similar_prompt(unquote(referer_path))
+    cookie = request.cookies.get(ROOT_PROMPT_COOKIE)
+    if cookie:
+        return unquote(cookie)
+    return None
+
+async def _run_mawa(request, username, prompt, root_prompt, cache_control):
+    styling_instructions = start_style_extraction(username, root_prompt, prompt)
+    if STREAM_RESPONSES:
+        return StreamingResponse(stream_root_agent(username, prompt, styling_instructions, root_prompt),
+                                 media_type="text/html", headers={"Cache-Control": cache_control})
+    return cached_response(request, await run_root_agent(username, prompt, styling_instructions, root_prompt),
+                           "text/html", cache_control)
+
+async def _resolve_components(username, components, root_prompt):
+    """
+    Resolves the components concurrently. They share one root prompt and one style extraction.
+
+    Yields:
+        {"id": ..., "html": ...} or {"id": ..., "error": ...} for each component, in the order they are resolved.
+    """
+    styling_instructions = start_style_extraction(username, root_prompt)
+
+    resolutions = _start_component_resolutions(username, components, root_prompt, styling_instructions)
+    try:
+        for resolution in asyncio.as_completed(resolutions):
+            yield await resolution
+    finally:
+        # the client has disconnected
+        for resolution in resolutions:
+            resolution.cancel()
+
+async def _render_page(username, root_prompt):
+    """
+    Generates (or loads from the cache) the page and inlines its components into it, so that a page with all
+    its components cached is loaded in one response. The components which are not resolved until the deadline
+    are loaded by the browser. The cacheable ones keep being generated in the background meanwhile and the request
+    of the browser waits for the same generation.
+    """
+    styling_instructions = start_style_extraction(username, root_prompt)
+    page = await run_root_agent(username, root_prompt, styling_instructions, root_prompt)
+    placeholders = find_component_placeholders(page)
+    if not placeholders:
+        return page
+
+    components = [{"id": placeholder.component_id, "prompt": placeholder.prompt} for placeholder in placeholders]
+    resolutions = _start_component_resolutions(username, components, root_prompt, styling_instructions)
+    done, pending = await asyncio.wait(resolutions, timeout=SERVER_SIDE_RENDERING_DEADLINE)
+    for component, resolution in zip(components, resolutions):
+        if resolution in pending:
+            classification = classify_request(json.dumps(component))
+            if classification is None or classification.cache_decision != CACHE:
+                # nobody could reuse the result
+                resolution.cancel()
+            else:
+                _background_resolutions.add(resolution)
+                resolution.add_done_callback(_background_resolutions.discard)
+
+    resolved_components = {
+        resolution.result()["id"]: resolution.result()["html"]
+        for resolution in done if "html" in resolution.result()
+    }
+    return inline_components(page, placeholders, resolved_components)
 
-    store_to_cache(ROOT_PROMPT, root_prompt)
-    return await _run_mawa(USER_NAME, root_prompt)
+def _start_component_resolutions(username, components, root_prompt, styling_instructions) -> list[asyncio.Task]:
+    return [
+        asyncio.create_task(_resolve_component(username, index, component, root_prompt, styling_instructions))
+        for index, component in enumerate(components)
+    ]
 
-async def _run_mawa(username, prompt):
-    styling_instructions = await run_style_extraction_agent(username, get_from_cache(ROOT_PROMPT))
-    return HTMLResponse(await run_root_agent(username, prompt, styling_instructions))
+async def _resolve_component(username, index, component, root_prompt, styling_instructions):
+    prompt = json.dumps(component) if isinstance(component, dict) else str(component)
+    structured_prompt = parse_structured_prompt(prompt) or {}
+    component_id = str(structured_prompt.get("id", index))
+    try:
+        return {"id": component_id,
+                "html": await run_root_agent(username, prompt, styling_instructions, root_prompt)}
+    except Exception:
+        logger.exception("The generation of the component '%s' has failed", component_id)
+        return {"id": component_id, "error": "The generation of the component has failed, please try again."}
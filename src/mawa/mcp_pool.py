@@ -0,0 +1,47 @@
+import asyncio
+import itertools
+import logging
+from typing import Optional
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools import BaseTool
+from google.adk.tools.base_toolset import BaseToolset
+from google.adk.tools.mcp_tool import MCPToolset
+from mcp import StdioServerParameters
+
+logger = logging.getLogger(__name__)
+
+
+class PooledMCPToolset(BaseToolset):
+    """
+    A toolset backed by a pool of connections to the same MCP server.
+    Each connection is a separate server process, so the concurrent requests do not queue on one channel.
+    The connections are handed out in a round-robin fashion and a connection which fails to list its tools
+    is skipped (its session manager reconnects it the next time it is used).
+    """
+
+    def __init__(self, connection_params: StdioServerParameters, size: int):
+        super().__init__()
+        self._connections = [MCPToolset(connection_params=connection_params) for _ in range(max(size, 1))]
+        self._next_connection = itertools.cycle(range(len(self._connections)))
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> list[BaseTool]:
+        last_error = None
+        for _ in range(len(self._connections)):
+            connection = self._connections[next(self._next_connection)]
+            try:
+                # listing the tools is a round trip to the server, so it doubles as the health check
+                return await connection.get_tools(readonly_context)
+            except Exception as e:
+                logger.warning("MCP connection is not healthy, trying the next one: %s", e)
+                last_error = e
+        raise last_error
+
+    async def warm_up(self):
+        """
+        Starts all the server processes upfront so that the requests do not pay for the startup.
+        """
+        await asyncio.gather(*(connection.get_tools() for connection in self._connections), return_exceptions=True)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(connection.close() for connection in self._connections), return_exceptions=True)
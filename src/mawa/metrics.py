@@ -0,0 +1,160 @@
+import bisect
+import threading
+from typing import Callable
+
+# The upper bounds (in seconds) of the buckets of the latency histograms, from a cache lookup to a long generation.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_metrics: list["_Metric"] = []
+# called right before the metrics are rendered, to update the values which are not tracked as they change
+_collectors: list[Callable[[], None]] = []
+
+
+class _Metric:
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...], metric_type: str):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.metric_type = metric_type
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def _label_values(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def _render_labels(self, label_values: tuple[str, ...], extra_labels: tuple[tuple[str, str], ...] = ()) -> str:
+        labels = list(zip(self.label_names, label_values)) + list(extra_labels)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value which only goes up, e.g. the number of the cache hits."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names, "counter")
+
+    def inc(self, amount: float = 1, **labels: str):
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._render_labels(label_values)} {_format(value)}" for label_values, value in values]
+
+
+class Gauge(_Metric):
+    """A value which can go up and down, e.g. the number of the live sessions."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names, "gauge")
+
+    def set(self, value: float, **labels: str):
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._render_labels(label_values)} {_format(value)}" for label_values, value in values]
+
+
+class Histogram(_Metric):
+    """The distribution of the observed values, e.g. the latencies of the model calls."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names, "histogram")
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        label_values = self._label_values(labels)
+        with self._lock:
+            # the count of the observations per bucket (the last one is the +Inf) and their sum
+            bucket_counts, total = self._values.get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[label_values] = (bucket_counts, total + value)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = sorted((label_values, (list(bucket_counts), total))
+                            for label_values, (bucket_counts, total) in self._values.items())
+        lines = []
+        for label_values, (bucket_counts, total) in values:
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative_count += bucket_count
+                le = "+Inf" if upper_bound == float("inf") else _format(upper_bound)
+                lines.append(f"{self.name}_bucket{self._render_labels(label_values, (('le', le),))} {cumulative_count}")
+            lines.append(f"{self.name}_sum{self._render_labels(label_values)} {_format(total)}")
+            lines.append(f"{self.name}_count{self._render_labels(label_values)} {cumulative_count}")
+        return lines
+
+
+def register_collector(collector: Callable[[], None]):
+    """
+    Registers a function which updates some of the metrics right before they are rendered.
+    """
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    """
+    Renders all the metrics in the Prometheus text format.
+    """
+    for collector in _collectors:
+        collector()
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    return repr(float(value))
+
+
+model_call_duration = Histogram(
+    "mawa_model_call_duration_seconds", "Duration of the model calls, from the request to the complete response.",
+    ("agent", "model"))
+model_tokens = Counter(
+    "mawa_model_tokens_total", "Tokens used by the model calls. The type is prompt, completion or thoughts.",
+    ("agent", "model", "type"))
+tool_call_duration = Histogram(
+    "mawa_tool_call_duration_seconds", "Duration of the tool calls (e.g. to the data provider MCP server).",
+    ("agent", "tool"))
+cache_operations = Counter(
+    "mawa_cache_operations_total",
+    "Lookups (hit, miss, stale) and removals (evict) of the cached values. The namespace is style, page, component, "
+    "user for the values describing a user, or memory for the in-memory tier in front of all of them.",
+    ("namespace", "result"))
+model_calls_rejected = Counter(
+    "mawa_model_calls_rejected_total", "Model calls not admitted because too many calls of the model were waiting.",
+    ("model", "priority"))
+model_slots = Gauge(
+    "mawa_model_slots", "Model calls per model. The state is in_use (being called) or waiting (for a free slot).",
+    ("model", "state"))
+sessions = Gauge(
+    "mawa_sessions", "Agent sessions per session service. The state is live, created, deleted, expired or rejected.",
+    ("service", "state"))
+user_state = Gauge(
+    "mawa_user_state", "Per-user state kept in memory per session service. The measure is users, bytes or evicted "
+    "(the users whose state has been deleted to stay under the size limit).",
+    ("service", "measure"))
@@ -0,0 +1,118 @@
+import html
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+COMPONENT_ID_ATTRIBUTE = "data-component-id"
+COMPONENT_PROMPT_ATTRIBUTE = "data-component-prompt"
+
+
+class ComponentPlaceholder(NamedTuple):
+    component_id: str
+    prompt: str
+    tag: str
+    attributes: list[tuple[str, str]]
+    # the offsets of the whole element in the page, from its start tag to the end of its end tag
+    start: int
+    end: int
+
+
+def find_component_placeholders(page: str) -> list[ComponentPlaceholder]:
+    """
+    Finds the elements the page loads its components into, marked by the data-component-id
+    and the data-component-prompt attributes (see the main_page_agent).
+
+    Returns:
+        The placeholders in the order they appear in the page.
+    """
+    parser = _PlaceholderParser(page)
+    try:
+        parser.feed(page)
+        parser.close()
+    except Exception:
+        # a page the parser can not handle is left to be loaded by the browser
+        return []
+    return parser.placeholders
+
+
+def inline_components(page: str, placeholders: list[ComponentPlaceholder], components: dict[str, str]) -> str:
+    """
+    Replaces the content of the placeholders by the HTML of their components. The placeholders of the components
+    missing in the components are left as they are, so that the browser loads them.
+
+    Args:
+        page: The HTML of the page
+        placeholders: The result of the find_component_placeholders on the page
+        components: The HTML of the components, by their ids
+    """
+    parts = []
+    position = 0
+    for placeholder in placeholders:
+        component = components.get(placeholder.component_id)
+        if component is None:
+            continue
+        parts.append(page[position:placeholder.start])
+        parts.append(f"<{placeholder.tag}{_render_attributes(placeholder.attributes)}>{component}</{placeholder.tag}>")
+        position = placeholder.end
+    parts.append(page[position:])
+    return "".join(parts)
+
+
+def _render_attributes(attributes: list[tuple[str, str]]) -> str:
+    rendered = []
+    for name, value in attributes:
+        # the inlined component is not loaded by the browser any more
+        if name in (COMPONENT_ID_ATTRIBUTE, COMPONENT_PROMPT_ATTRIBUTE):
+            continue
+        if name == "class":
+            value = " ".join(css_class for css_class in (value or "").split() if css_class != "loading-message")
+            if not value:
+                continue
+        rendered.append(f' {name}="{html.escape(value or "", quote=True)}"')
+    return "".join(rendered)
+
+
+class _PlaceholderParser(HTMLParser):
+
+    def __init__(self, page: str):
+        super().__init__()
+        self.placeholders: list[ComponentPlaceholder] = []
+        self._page = page
+        # the parser reports the positions as (line, column), the lines are only split by the \n
+        self._line_offsets = [0]
+        for line in page.split("\n"):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+        # the placeholder whose end tag is being looked for and the depth of its tag nested in it
+        self._open_placeholder = None
+        self._depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._open_placeholder is not None:
+            if tag == self._open_placeholder["tag"]:
+                self._depth += 1
+            return
+
+        attributes = dict(attrs)
+        if attributes.get(COMPONENT_ID_ATTRIBUTE) and attributes.get(COMPONENT_PROMPT_ATTRIBUTE) is not None:
+            self._open_placeholder = {
+                "component_id": attributes[COMPONENT_ID_ATTRIBUTE],
+                "prompt": attributes[COMPONENT_PROMPT_ATTRIBUTE],
+                "tag": tag,
+                "attributes": attrs,
+                "start": self._offset(),
+            }
+            self._depth = 0
+
+    def handle_endtag(self, tag):
+        if self._open_placeholder is None or tag != self._open_placeholder["tag"]:
+            return
+        if self._depth:
+            self._depth -= 1
+            return
+
+        end = self._page.find(">", self._offset()) + 1
+        self.placeholders.append(ComponentPlaceholder(end=end, **self._open_placeholder))
+        self._open_placeholder = None
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
@@ -0,0 +1,120 @@
+import ast
+import json
+import re
+from typing import NamedTuple, Optional
+
+# Possible values of the 'cache_decision_agent_output' state entry.
+LIVE = "LIVE"
+CACHE = "CACHE"
+
+# Names of the sub-agents of the generic_webpage_root_agent the requests can be dispatched to.
+MAIN_PAGE_AGENT = "main_page_agent"
+COMPONENT_PAGE_AGENT = "component_page_agent"
+DATA_LOADER_AGENT = "data_loader_agent"
+DATA_SAVER_AGENT = "data_saver_agent"
+
+# Names of the sub-agents of the component_parallel_sub_agents.
+TABULAR_DATA_VISUALIZATION_AGENT = "tabular_data_visualization_agent"
+CHART_DATA_VISUALIZATION_AGENT = "chart_data_visualization_agent"
+ADD_DATA_AGENT = "add_data_agent"
+
+# The prefix the forms generated by the add_data_agent put in front of the JSON with the new match.
+_CREATE_MATCH_PATTERN = re.compile(r"^\s*create a new match\b\s*:?\s*\{", re.IGNORECASE)
+
+# If the user talks about caching in the prompt, the cache_decision_agent has to decide.
+_CACHE_HINT_PATTERN = re.compile(r"\b(cache[ds]?|caching|live|always calculate|recalculate)\b", re.IGNORECASE)
+
+# What the prompt of a component has to mention for each of the sub-agents to be needed.
+_CHART_PATTERN = re.compile(r"\b(charts?|graphs?|plots?|pie|histograms?|visuali[sz](e|es|ed|ing|ation))\b", re.IGNORECASE)
+_TABLE_PATTERN = re.compile(r"\b(tables?|tabular|rows?|columns?)\b", re.IGNORECASE)
+# without a chart, these are shown as a table
+_DATA_PATTERN = re.compile(r"\b(match(es)?|scores?|results?|lists?|leaderboards?|standings?|rankings?)\b", re.IGNORECASE)
+_ADD_DATA_PATTERN = re.compile(r"\b(forms?|(add|adding|create|creating|insert|inserting|enter|entering)\b.{0,30}\bmatch(es)?)\b",
+                               re.IGNORECASE)
+# the name of the game, not a request for a table
+_TABLE_FOOTBALL_PATTERN = re.compile(r"\btable[\s-]*football\b", re.IGNORECASE)
+
+
+class RequestClassification(NamedTuple):
+    cache_decision: str
+    agent_name: str
+
+
+def classify_request(prompt: str) -> Optional[RequestClassification]:
+    """
+    Classifies the request without calling any model.
+    Recognizes the requests sent by the generated pages:
+        - {'id': ..., 'prompt': ...} bodies of the components
+        - {"request": "load data", ...} bodies of the tables and charts
+        - "create a new match: {...}" bodies of the add match forms
+
+    Args:
+        prompt: The prompt as received from the user.
+
+    Returns:
+        The cache decision together with the name of the agent which should handle the request,
+        or None if the request is a free text prompt which has to be classified by the LLM agents.
+    """
+    if _CREATE_MATCH_PATTERN.match(prompt):
+        return RequestClassification(LIVE, DATA_SAVER_AGENT)
+
+    data = parse_structured_prompt(prompt)
+    if data is None:
+        return None
+
+    if 'id' in data and 'prompt' in data:
+        if _CACHE_HINT_PATTERN.search(str(data['prompt'])):
+            return None
+        return RequestClassification(CACHE, COMPONENT_PAGE_AGENT)
+
+    if str(data.get('request', '')).strip().lower() == 'load data':
+        return RequestClassification(LIVE, DATA_LOADER_AGENT)
+
+    return None
+
+
+def select_component_agents(prompt: str) -> Optional[list[str]]:
+    """
+    Selects the sub-agents of the component_parallel_sub_agents the prompt of a component needs, without calling
+    any model. The rules err on the side of selecting more agents, an agent which is not needed returns NO_CONTENT.
+
+    Args:
+        prompt: The body of the component request, or just its prompt.
+
+    Returns:
+        The names of the needed sub-agents, or None if the prompt does not ask for any of them
+        and all of them have to decide themselves.
+    """
+    data = parse_structured_prompt(prompt)
+    if data is not None and 'prompt' in data:
+        prompt = str(data['prompt'])
+    prompt = _TABLE_FOOTBALL_PATTERN.sub(" ", prompt)
+
+    # the match in "add a new match" is not the data to show
+    shown_data = _DATA_PATTERN.search(_ADD_DATA_PATTERN.sub(" ", prompt))
+    selected_agents = []
+    if _TABLE_PATTERN.search(prompt) or (shown_data and not _CHART_PATTERN.search(prompt)):
+        selected_agents.append(TABULAR_DATA_VISUALIZATION_AGENT)
+    if _CHART_PATTERN.search(prompt):
+        selected_agents.append(CHART_DATA_VISUALIZATION_AGENT)
+    if _ADD_DATA_PATTERN.search(prompt):
+        selected_agents.append(ADD_DATA_AGENT)
+    return selected_agents or None
+
+
+def parse_structured_prompt(prompt: str) -> Optional[dict]:
+    """
+    Parses the prompt sent as a JSON object (or a python dict literal).
+
+    Returns:
+        The parsed dict or None if the prompt is not a dict.
+    """
+    try:
+        data = json.loads(prompt)
+    except ValueError:
+        try:
+            data = ast.literal_eval(prompt)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            return None
+
+    return data if isinstance(data, dict) else None
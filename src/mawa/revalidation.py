@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Callable, Optional
+
+from mawa.admission import BACKGROUND_PRIORITY, request_priority
+from mawa.single_flight import single_flight_stream
+
+logger = logging.getLogger(__name__)
+
+# If enabled, the stale pages and components (edited by someone else, or generated by older agents or styling)
+# are served right away and regenerated in the background, instead of being generated while the visitor waits.
+STALE_WHILE_REVALIDATE = os.getenv("STALE_WHILE_REVALIDATE", "true").lower() == "true"
+# The number of the regenerations running at the same time.
+REVALIDATION_WORKERS = int(os.getenv("REVALIDATION_WORKERS", "2"))
+# The maximal number of the regenerations waiting for a worker. If it is full, the stale value keeps being served
+# and the regeneration is requested again by the next visitor.
+REVALIDATION_QUEUE_SIZE = int(os.getenv("REVALIDATION_QUEUE_SIZE", "100"))
+
+_queue: Optional[asyncio.Queue] = None
+_workers: list[asyncio.Task] = []
+# the keys queued or being regenerated, so that each stale value is regenerated only once
+_pending_keys: set[str] = set()
+
+
+def revalidate(key: str, generate: Callable[[], AsyncIterator[str]]) -> bool:
+    """
+    Queues the regeneration of a stale value. The generate is expected to store its result to the cache.
+    It runs through the single_flight_stream, so the visitors missing the cache meanwhile wait for it
+    instead of generating the same value again.
+
+    Args:
+        key: The cache key of the stale value
+        generate: Regenerates the value, e.g. the _generate_response
+
+    Returns:
+        False if the regeneration of the key is already pending, or if the queue is full.
+    """
+    if key in _pending_keys:
+        return False
+    _start_workers()
+    try:
+        _queue.put_nowait((key, generate))
+    except asyncio.QueueFull:
+        logger.warning("The revalidation queue is full, '%s' stays stale", key)
+        return False
+    _pending_keys.add(key)
+    return True
+
+
+async def stop_revalidation_workers():
+    """
+    Cancels the workers together with the regenerations they are running.
+    """
+    global _queue
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _pending_keys.clear()
+    _queue = None
+
+
+def _start_workers():
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.Queue(maxsize=REVALIDATION_QUEUE_SIZE)
+    _workers.extend(asyncio.create_task(_work(_queue)) for _ in range(max(REVALIDATION_WORKERS, 1)))
+
+
+async def _work(queue: asyncio.Queue):
+    # the visitors waiting for their pages and components go first
+    request_priority.set(BACKGROUND_PRIORITY)
+    while True:
+        key, generate = await queue.get()
+        try:
+            async for _ in single_flight_stream(key, generate):
+                pass
+        except Exception:
+            logger.exception("The regeneration of '%s' has failed", key)
+        finally:
+            _pending_keys.discard(key)
+            queue.task_done()
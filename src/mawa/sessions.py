@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from google.adk.events import Event, EventActions
+from google.adk.sessions import BaseSessionService, DatabaseSessionService, InMemorySessionService, Session
+
+# Seconds after which a session not deleted by its request (e.g. a stuck one) is deleted by the next request.
+SESSION_TTL = float(os.getenv("SESSION_TTL", "900"))
+# The maximal number of the sessions alive at the same time per session service. The requests beyond it are rejected.
+MAX_LIVE_SESSIONS = int(os.getenv("MAX_LIVE_SESSIONS", "1000"))
+# The maximal size (in bytes) of the per-user state (the user: keys) kept in the memory of the worker.
+# The state of the least recently active users is deleted once it is exceeded. Not used with the SESSION_DB_URL.
+MAX_USER_STATE_SIZE = int(os.getenv("MAX_USER_STATE_SIZE", str(64 * 1024 * 1024)))
+# The database the sessions and the per-user state are stored in, e.g. sqlite:///sessions.sqlite3, so that all the
+# workers share them. If not set, they are kept in the memory of each worker.
+SESSION_DB_URL = os.getenv("SESSION_DB_URL")
+
+
+def create_session_service() -> BaseSessionService:
+    """
+    Creates the session service the state shared by the requests of a user (e.g. the user: keys) is stored in.
+    """
+    if SESSION_DB_URL:
+        return DatabaseSessionService(SESSION_DB_URL)
+    return InMemorySessionService()
+
+
+class TooManySessions(Exception):
+    """Raised if a session is requested while the MAX_LIVE_SESSIONS requests are still being handled."""
+
+
+class EphemeralSessions:
+    """
+    Hands out the sessions which live only for the duration of one request.
+    The state stored under the user: prefix outlives the sessions, since the session service keeps it per user.
+    """
+
+    def __init__(self, session_service: BaseSessionService, app_name: str):
+        self.session_service = session_service
+        self._app_name = app_name
+        # (user_id, session_id) -> the creation time, the oldest first
+        self._live_sessions: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._created = 0
+        self._deleted = 0
+        self._expired = 0
+        self._rejected = 0
+        # user_id -> the size of the per-user state kept in memory, the least recently active user first
+        self._user_state_sizes: OrderedDict[str, int] = OrderedDict()
+        self._user_state_size = 0
+        self._evicted_user_states = 0
+
+    @asynccontextmanager
+    async def session(self, user_id: str, state_delta: Optional[dict] = None) -> AsyncIterator[Session]:
+        """
+        Creates a session which is deleted once the request is done with it.
+        Raises TooManySessions if the MAX_LIVE_SESSIONS sessions are in use, none of them is taken away from its request.
+
+        Args:
+            user_id: The id of the user
+            state_delta: The initial state, stored by a single event
+        """
+        await self._delete_expired_sessions()
+        if len(self._live_sessions) >= MAX_LIVE_SESSIONS:
+            self._rejected += 1
+            raise TooManySessions(f"All the {MAX_LIVE_SESSIONS} sessions are in use")
+
+        session = await self.session_service.create_session(
+            app_name=self._app_name,
+            user_id=user_id,
+            session_id=str(uuid.uuid4())
+        )
+        self._live_sessions[(user_id, session.id)] = time.monotonic()
+        self._created += 1
+        try:
+            if state_delta:
+                # the user: keys have to go through an event to be stored per user, not only in this session
+                await self.session_service.append_event(session, Event(
+                    invocation_id="initial_state",
+                    author="system",
+                    actions=EventActions(state_delta=state_delta),
+                    timestamp=time.time()
+                ))
+            yield session
+        finally:
+            if self._live_sessions.pop((user_id, session.id), None) is not None:
+                self._deleted += 1
+                await self._delete_session(user_id, session.id)
+            self._account_user_state(user_id)
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "live": len(self._live_sessions),
+            "created": self._created,
+            "deleted": self._deleted,
+            "expired": self._expired,
+            "rejected": self._rejected,
+        }
+
+    def user_state_metrics(self) -> dict[str, int]:
+        return {
+            "users": len(self._user_state_sizes),
+            "bytes": self._user_state_size,
+            "evicted": self._evicted_user_states,
+        }
+
+    def _account_user_state(self, user_id: str):
+        """
+        Accounts the per-user state of the user to the MAX_USER_STATE_SIZE and deletes the state
+        of the least recently active users once it is exceeded. The InMemorySessionService never deletes it itself.
+        """
+        if not isinstance(self.session_service, InMemorySessionService):
+            return
+        user_states = self.session_service.user_state.get(self._app_name, {})
+        self._user_state_size -= self._user_state_sizes.pop(user_id, 0)
+        if user_states.get(user_id):
+            self._user_state_sizes[user_id] = _size_of_state(user_states[user_id])
+            self._user_state_size += self._user_state_sizes[user_id]
+        while len(self._user_state_sizes) > 1 and self._user_state_size > MAX_USER_STATE_SIZE:
+            evicted_user_id, evicted_size = self._user_state_sizes.popitem(last=False)
+            self._user_state_size -= evicted_size
+            self._evicted_user_states += 1
+            user_states.pop(evicted_user_id, None)
+
+    async def _delete_expired_sessions(self):
+        """
+        Deletes the sessions older than the SESSION_TTL, their requests are considered stuck.
+        The sessions of the finished requests are already deleted by the session().
+        """
+        expiration_time = time.monotonic() - SESSION_TTL
+        while self._live_sessions:
+            (user_id, session_id), created_at = next(iter(self._live_sessions.items()))
+            if created_at >= expiration_time:
+                break
+            self._expired += 1
+            del self._live_sessions[(user_id, session_id)]
+            await self._delete_session(user_id, session_id)
+
+    async def _delete_session(self, user_id: str, session_id: str):
+        await self.session_service.delete_session(app_name=self._app_name, user_id=user_id, session_id=session_id)
+        if isinstance(self.session_service, InMemorySessionService):
+            # the InMemorySessionService keeps the (empty) sessions of each user it has ever seen otherwise
+            user_sessions = self.session_service.sessions.get(self._app_name, {})
+            if not user_sessions.get(user_id, True):
+                del user_sessions[user_id]
+
+
+def _size_of_state(state: dict) -> int:
+    return sum(len(key) + len(str(value)) for key, value in state.items())
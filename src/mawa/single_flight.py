@@ -0,0 +1,111 @@
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# How long (in seconds) a request waits for the result of the same generation started by a different request.
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "300"))
+
+_in_flight: dict[str, asyncio.Future] = {}
+# the generations run detached from the requests of their leaders, so the task references are kept here
+_generations: set[asyncio.Task] = set()
+
+# marks the end of the chunks of a streamed generation
+_END_OF_STREAM = object()
+
+
+class SingleFlightCancelled(Exception):
+    """Raised to the waiting requests if the generation itself has been cancelled, e.g. the server is shutting down."""
+
+
+async def single_flight(key: str, generate: Callable[[], Awaitable[T]],
+                        timeout: Optional[float] = SINGLE_FLIGHT_TIMEOUT) -> T:
+    """
+    Coalesces the concurrent identical generations. The first request with the key (the leader) starts the generate,
+    the requests with the same key arriving while it is running wait for its result instead of generating it again.
+    The generation runs detached from the request of the leader, so if the leader is cancelled (e.g. its client
+    disconnects), the generation goes on for the others.
+
+    Args:
+        key: Identifies the generation, e.g. the cache key the result will be stored under.
+        generate: Produces the result. Only called by the leader.
+        timeout: How long the waiting requests wait for the leader before raising the TimeoutError.
+
+    Returns:
+        The result of the generate. If it raises, all the waiting requests get the same exception.
+    """
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        return await asyncio.wait_for(asyncio.shield(in_flight), timeout)
+
+    future = _lead(key)
+    _start_generation(key, future, generate())
+    return await asyncio.shield(future)
+
+
+async def single_flight_stream(key: str, generate: Callable[[], AsyncIterator[str]],
+                               timeout: Optional[float] = SINGLE_FLIGHT_TIMEOUT) -> AsyncIterator[str]:
+    """
+    The same as single_flight for the generations producing the text in chunks.
+    The leader yields the chunks as they are generated, the waiting requests get the whole text at once.
+    """
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        yield await asyncio.wait_for(asyncio.shield(in_flight), timeout)
+        return
+
+    future = _lead(key)
+    chunks = asyncio.Queue()
+    _start_generation(key, future, _collect_chunks(generate(), chunks))
+    while (chunk := await chunks.get()) is not _END_OF_STREAM:
+        yield chunk
+    # raises the error of the generation, if any
+    await asyncio.shield(future)
+
+
+async def _collect_chunks(chunks: AsyncIterator[str], queue: asyncio.Queue) -> str:
+    collected_chunks = []
+    try:
+        async for chunk in chunks:
+            collected_chunks.append(chunk)
+            queue.put_nowait(chunk)
+    finally:
+        queue.put_nowait(_END_OF_STREAM)
+    return "".join(collected_chunks)
+
+
+def _lead(key: str) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    return future
+
+
+def _start_generation(key: str, future: asyncio.Future, generation: Awaitable):
+    def settle(task: asyncio.Task):
+        _generations.discard(task)
+        if task.cancelled():
+            _fail(key, future, asyncio.CancelledError())
+        elif task.exception() is not None:
+            _fail(key, future, task.exception())
+        else:
+            _succeed(key, future, task.result())
+
+    task = asyncio.ensure_future(generation)
+    _generations.add(task)
+    task.add_done_callback(settle)
+
+
+def _succeed(key: str, future: asyncio.Future, result):
+    _in_flight.pop(key, None)
+    future.set_result(result)
+
+
+def _fail(key: str, future: asyncio.Future, error: BaseException):
+    _in_flight.pop(key, None)
+    if not isinstance(error, Exception):
+        # the generation itself has been cancelled
+        error = SingleFlightCancelled(f"The generation of '{key}' has been cancelled")
+    future.set_exception(error)
+    # mark the exception as retrieved, there may be no waiting requests to retrieve it
+    future.exception()
@@ -1,5 +1,7 @@
 import ast
 
+from mawa.cache import COMPONENT_NAMESPACE, PAGE_NAMESPACE
+
 def _maybe_extract_component_id_from_prompt(prompt: str):
     try:
         data = ast.literal_eval(prompt)
@@ -9,4 +11,11 @@ def _maybe_extract_component_id_from_prompt(prompt: str):
         else:
             return prompt
     except (ValueError, SyntaxError, TypeError):
-        return prompt
\ No newline at end of file
+        return prompt
+
+
+def _cache_namespace_of_prompt(prompt: str):
+    """
+    The namespace of the cache metrics the generation of the prompt is counted in: a component or a page.
+    """
+    return COMPONENT_NAMESPACE if _maybe_extract_component_id_from_prompt(prompt) != prompt else PAGE_NAMESPACE
@@ -1,67 +1,158 @@
+from contextlib import contextmanager
 from mcp.server.fastmcp import FastMCP
 import uuid
 import json
 import os
+import sqlite3
+import threading
 
 mcp = FastMCP("Mawa Data Provider")
+# Only read to migrate the data stored by the previous versions.
 DATA_FILE = "/tmp/matches_data.json"
 
-def load_data():
-    """Loads the data from the JSON file."""
+# The matches are stored in SQLite in the WAL mode, so the readers do not block the writer
+# and the concurrent add_match calls (even from different processes) do not lose updates.
+DATABASE_FILE = os.getenv("MATCHES_DATABASE_FILE", "/tmp/matches_data.sqlite3")
+
+_MOCK_MATCHES_DATA = {
+    "brno": [
+        {
+            "id": "match_id1",
+            "player1": "Jahodovy Knedlik",
+            "player1_score": 15,
+            "player2": "Nakladany Hermelin",
+            "player2_score": 10,
+        },
+        {
+            "id": "match_id2",
+            "player1": "Tom",
+            "player1_score": 0,
+            "player2": "Hovezi Gulas",
+            "player2_score": 9,
+        },
+        {
+            "id": "match_id3",
+            "player1": "Tom",
+            "player1_score": 1,
+            "player2": "Nakladany Hermelin",
+            "player2_score": 9,
+        },
+    ],
+    "hradec": [
+        {
+            "id": "match_id3",
+            "player1": "Rizek",
+            "player1_score": 10,
+            "player2": "Kachna",
+            "player2_score": 4,
+        },
+        {
+            "id": "match_id4",
+            "player1": "Salam",
+            "player1_score": 10,
+            "player2": "Kachna",
+            "player2_score": 9,
+        },
+    ]
+}
+
+_thread_local = threading.local()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Returns the connection of the current thread, opening and initializing the database if needed."""
+    connection = getattr(_thread_local, "connection", None)
+    if connection is None or _thread_local.database_file != DATABASE_FILE:
+        connection = sqlite3.connect(DATABASE_FILE, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        _initialize_database(connection)
+        _thread_local.connection = connection
+        _thread_local.database_file = DATABASE_FILE
+    return connection
+
+
+@contextmanager
+def _transaction(connection: sqlite3.Connection):
+    """Runs the statements in one atomic transaction which takes the write lock upfront."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def _initialize_database(connection: sqlite3.Connection):
+    """Creates the schema. An empty database is filled from the old JSON file, or with the mock data."""
+    with _transaction(connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS leagues (name TEXT PRIMARY KEY)")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS matches (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                league TEXT NOT NULL REFERENCES leagues (name),
+                id TEXT NOT NULL,
+                player1 TEXT NOT NULL,
+                player1_score INTEGER NOT NULL,
+                player2 TEXT NOT NULL,
+                player2_score INTEGER NOT NULL
+            )
+            """
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS matches_by_league ON matches (league, seq)")
+
+        if connection.execute("SELECT 1 FROM leagues LIMIT 1").fetchone() is None:
+            for league, matches in _load_json_data().items():
+                connection.execute("INSERT INTO leagues (name) VALUES (?)", (league,))
+                _insert_matches(connection, league, matches)
+
+
+def _load_json_data() -> dict:
+    """Loads the data from the JSON file used before the SQLite database, or returns the mock data."""
     if os.path.exists(DATA_FILE):
         with open(DATA_FILE, "r") as f:
             return json.load(f)
-    else:
-        # Initialize with mock data if the file doesn't exist
-        mock_matches_data = {
-            "brno": [
-                {
-                    "id": "match_id1",
-                    "player1": "Jahodovy Knedlik",
-                    "player1_score": 15,
-                    "player2": "Nakladany Hermelin",
-                    "player2_score": 10,
-                },
-                {
-                    "id": "match_id2",
-                    "player1": "Tom",
-                    "player1_score": 0,
-                    "player2": "Hovezi Gulas",
-                    "player2_score": 9,
-                },
-                {
-                    "id": "match_id3",
-                    "player1": "Tom",
-                    "player1_score": 1,
-                    "player2": "Nakladany Hermelin",
-                    "player2_score": 9,
-                },
-            ],
-            "hradec": [
-                {
-                    "id": "match_id3",
-                    "player1": "Rizek",
-                    "player1_score": 10,
-                    "player2": "Kachna",
-                    "player2_score": 4,
-                },
-                {
-                    "id": "match_id4",
-                    "player1": "Salam",
-                    "player1_score": 10,
-                    "player2": "Kachna",
-                    "player2_score": 9,
-                },
-            ]
-        }
-        with open(DATA_FILE, "w") as f:
-            json.dump(mock_matches_data, f, indent=4)
-        return mock_matches_data
-
-def save_data(data):
-    """Saves the data to the JSON file."""
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    return _MOCK_MATCHES_DATA
+
+
+def _insert_matches(connection: sqlite3.Connection, league: str, matches: list[dict]):
+    connection.executemany(
+        "INSERT INTO matches (league, id, player1, player1_score, player2, player2_score) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (league, match["id"], match["player1"], match["player1_score"], match["player2"], match["player2_score"])
+            for match in matches
+        ]
+    )
+
+
+def _league_exists(connection: sqlite3.Connection, league: str) -> bool:
+    return connection.execute("SELECT 1 FROM leagues WHERE name = ?", (league,)).fetchone() is not None
+
+
+def get_leagues() -> list[str]:
+    """Returns the names of all the leagues."""
+    return [row[0] for row in _get_connection().execute("SELECT name FROM leagues ORDER BY name")]
+
+
+def add_matches(league: str, matches: list[dict]) -> dict:
+    """Adds many matches to the league in one transaction.
+
+        Args:
+            league (str): The name of the league (e.g., "Brno", "Hradec").
+            matches (list[dict]): The matches with the player1, player1_score, player2 and player2_score keys.
+
+        Returns:
+            dict: The same as the add_match.
+    """
+    league_normalized = league.lower().replace(" ", "")
+    connection = _get_connection()
+    with _transaction(connection):
+        if not _league_exists(connection, league_normalized):
+            return {"status": "error", "error_message": f"No league information for the league: '{league}'"}
+        _insert_matches(connection, league_normalized, [{**match, "id": str(uuid.uuid4())} for match in matches])
+    return {"status": "success"}
 
 @mcp.tool()
 def get_matches(league: str) -> dict:
@@ -85,11 +176,19 @@ def get_matches(league: str) -> dict:
 
                 If 'error', includes an 'error_message' key.
     """
-    matches_data = load_data()
+    connection = _get_connection()
     league_normalized = league.lower().replace(" ", "")
 
-    if league_normalized in matches_data:
-        return {"status": "success", "users": matches_data[league_normalized]}
+    if _league_exists(connection, league_normalized):
+        rows = connection.execute(
+            "SELECT id, player1, player1_score, player2, player2_score FROM matches WHERE league = ? ORDER BY seq",
+            (league_normalized,)
+        )
+        return {"status": "success", "users": [
+            {"id": match_id, "player1": player1, "player1_score": player1_score,
+             "player2": player2, "player2_score": player2_score}
+            for match_id, player1, player1_score, player2, player2_score in rows
+        ]}
     else:
         return {"status": "error", "error_message": f"No league information for the league: '{league}'"}
 
@@ -111,19 +210,13 @@ def add_match(league: str, player1: str, player1_score: int, player2: str, playe
             If the status is "error", the response looks like this:
              {"status": "success", "error_message": "Unknown league."}
     """
-    matches_data = load_data()
-    league_normalized = league.lower().replace(" ", "")
-    if league_normalized in matches_data:
-        matches_data[league_normalized].append(
-            {
-                "id": str(uuid.uuid4()),
-                "player1": player1,
-                "player1_score": player1_score,
-                "player2": player2,
-                "player2_score": player2_score,
-            }
-        )
-        save_data(matches_data)
-        return {"status": "success"}
-    else:
-        return {"status": "error", "error_message": f"No league information for the league: '{league}'"}
\ No newline at end of file
+    return add_matches(league, [{
+        "player1": player1,
+        "player1_score": player1_score,
+        "player2": player2,
+        "player2_score": player2_score,
+    }])
+
+
+if __name__ == "__main__":
+    mcp.run()
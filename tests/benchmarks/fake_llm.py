@@ -0,0 +1,85 @@
+import asyncio
+import json
+from typing import AsyncGenerator
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+from mawa.llm import register_llm
+
+FAKE_PAGE = """```html
+<!DOCTYPE html>
+<html>
+<head><title>Dynamic Table Football</title></head>
+<body>
+    <div class="masthead">Dynamic Table Football <button>Logout</button></div>
+    <div id="detail-component-id-1" class="loading-message" data-component-id="component_1_1"
+         data-component-prompt="Generate me a component with a table of matches from the brno league.">Loading Component...</div>
+</body>
+</html>
+```"""
+
+FAKE_TABLE = """<div class="matches">
+    <table><thead><tr><th>Player 1</th><th>Player 2</th><th>Score 1</th><th>Score 2</th></tr></thead><tbody></tbody></table>
+</div>"""
+
+# The canned response of each agent. The agents not listed here get the NO_CONTENT.
+RESPONSES = {
+    "cache_decision_agent": "LIVE",
+    "style_extraction_agent": "Use a dark background (#222222), light text (#eeeeee) and the Arial font.",
+    "main_page_agent": FAKE_PAGE,
+    "tabular_data_visualization_agent": FAKE_TABLE,
+    "component_page_merger_agent": FAKE_TABLE,
+    "data_loader_agent": json.dumps([{"player1": "Alice", "player2": "Bob", "player1_score": 10, "player2_score": 8}]),
+    "data_saver_agent": json.dumps({"status": "success"}),
+}
+# The agent the generic_webpage_root_agent transfers the request to.
+ROUTED_AGENT = "main_page_agent"
+# How long (in seconds) each call of the fake model takes.
+DELAY = 0.0
+
+calls: list[str] = []
+
+
+class FakeLlm(BaseLlm):
+    """
+    A deterministic stand-in for Gemini. Answers each agent with its canned response from the RESPONSES
+    after the DELAY, without any network access. The requests are recognized by the agent name label ADK adds to them.
+    """
+
+    @classmethod
+    def supported_models(cls) -> list[str]:
+        return [r"gemini-.*"]
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        agent_name = (llm_request.config.labels or {}).get("adk_agent_name", "")
+        calls.append(agent_name)
+        if DELAY:
+            await asyncio.sleep(DELAY)
+
+        if agent_name == "generic_webpage_root_agent":
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part(
+                function_call=types.FunctionCall(name="transfer_to_agent", args={"agent_name": ROUTED_AGENT})
+            )]))
+            return
+
+        text = RESPONSES.get(agent_name, "NO_CONTENT")
+        if stream:
+            for start in range(0, len(text), 64):
+                yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text[start:start + 64])]),
+                                  partial=True)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=len(str(llm_request.config.system_instruction)) // 4,
+                candidates_token_count=len(text) // 4,
+            ),
+        )
+
+
+def register_fake_llm():
+    """
+    Makes all the gemini-* models of the agents resolve to the FakeLlm.
+    """
+    register_llm(FakeLlm)
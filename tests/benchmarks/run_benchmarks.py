@@ -0,0 +1,310 @@
+"""
+Offline micro-benchmarks of the orchestration around the models. The models are replaced by the FakeLlm,
+so the results do not depend on the network or on the Gemini latency.
+
+Run from the root of the repository:
+    python -m tests.benchmarks.run_benchmarks --output results.json
+"""
+import argparse
+import asyncio
+import datetime
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple
+
+# the configuration of mawa is read when it is imported, so it has to point to the scratch files first
+_scratch_dir = tempfile.mkdtemp(prefix="mawa-benchmarks-")
+os.environ["CACHE_DIR"] = os.path.join(_scratch_dir, "cache")
+os.environ["MATCHES_DATABASE_FILE"] = os.path.join(_scratch_dir, "matches.sqlite3")
+os.environ["DATA_PROVIDER_TRANSPORT"] = "in_process"
+os.environ.setdefault("STALE_WHILE_REVALIDATE", "true")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src"))
+
+from google.adk.models import LlmResponse
+from google.adk.sessions.state import State
+from google.genai import types
+
+from tests.benchmarks import fake_llm
+
+fake_llm.register_fake_llm()
+
+from mawa import adk_bridge, cache, callbacks
+from mawa.agent import create_main_agent
+from mawa.constants import ROOT_PROMPT
+from mawa.data_access import load_data_directly
+from mawa_mcp_server.data_provider import add_match, get_matches
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # returns the function to measure, which may be a coroutine function
+    setup: Callable[[], Callable]
+    iterations: int
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, iterations: int):
+    def register(setup: Callable[[], Callable]):
+        BENCHMARKS.append(Benchmark(name, setup, iterations))
+        return setup
+    return register
+
+
+class _CallbackContext:
+    """The part of the CallbackContext the measured callbacks use."""
+
+    def __init__(self, state: dict, prompt: str = ""):
+        self.state = State(state, {})
+        self.user_content = types.Content(role="user", parts=[types.Part(text=prompt)])
+        self.invocation_id = "benchmark"
+        self.agent_name = "benchmark_agent"
+
+
+class _LlmRequest:
+    """The part of the LlmRequest the measured callbacks use."""
+
+    def __init__(self, config: types.GenerateContentConfig):
+        self.config = config
+
+
+def _resolved_future(value):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+@benchmark("agent.create_main_agent", iterations=50)
+def _create_main_agent():
+    return create_main_agent
+
+
+@benchmark("callbacks.load_from_cache.hit", iterations=2000)
+def _load_from_cache_hit():
+    root_prompt = "a page with the matches of the brno league"
+    prompt = str({"id": "component_1_1", "prompt": "a table of matches"})
+    cache.store_version_to_cache(root_prompt + "component_1_1", "v1", fake_llm.FAKE_TABLE, cache.COMPONENT_NAMESPACE)
+    callback_context = _CallbackContext({"cache_decision_agent_output": "CACHE", ROOT_PROMPT: root_prompt}, prompt)
+
+    async def load_from_cache():
+        callbacks.pending_cache_version.set(_resolved_future("v1"))
+        callbacks.pending_cache_key.set(root_prompt + "component_1_1")
+        response = await callbacks.load_from_cache(callback_context, None)
+        assert response is not None
+    return load_from_cache
+
+
+@benchmark("callbacks.clean_response_parts.1mb", iterations=200)
+def _clean_response_parts():
+    body = "```html\n" + ("<tr><td>Alice</td><td>Bob</td><td>10</td><td>8</td></tr>\n" * 18000) + "```\n"
+    response = LlmResponse(content=types.Content(role="model", parts=[types.Part(text=body)]))
+
+    def clean_response_parts():
+        callbacks.clean_response_parts(response.model_copy(deep=True))
+    return clean_response_parts
+
+
+@benchmark("callbacks.inject_stored_component_ids.1000_components", iterations=200)
+def _inject_stored_component_ids():
+    state = {f"user:component_{i // 10}_{i % 10}": f"Generate me a table number {i}." for i in range(1000)}
+    state.update({f"unrelated_key_{i}": "value" for i in range(1000)})
+    callback_context = _CallbackContext(state)
+
+    def inject_stored_component_ids():
+        request = types.GenerateContentConfig(system_instruction="You are an agent which generates a simple HTML page.")
+        callbacks.inject_stored_component_ids(callback_context, _LlmRequest(request))
+    return inject_stored_component_ids
+
+
+@benchmark("cache.store_to_cache", iterations=2000)
+def _store_to_cache():
+    value = fake_llm.FAKE_TABLE
+    keys = iter(range(10 ** 9))
+
+    def store_to_cache():
+        cache.store_to_cache(f"benchmark key {next(keys)}", value)
+    return store_to_cache
+
+
+@benchmark("cache.get_or_miss.memory_hit", iterations=20000)
+def _get_or_miss_memory_hit():
+    cache.store_to_cache("benchmark memory hit", fake_llm.FAKE_TABLE)
+
+    def get_or_miss():
+        assert cache.get_or_miss("benchmark memory hit") is not cache.CACHE_MISS
+    return get_or_miss
+
+
+@benchmark("cache.get_or_miss.disk_hit", iterations=5000)
+def _get_or_miss_disk_hit():
+    cache.store_to_cache("benchmark disk hit", fake_llm.FAKE_TABLE)
+
+    def get_or_miss():
+        with cache.memory_cache_lock:
+            cache.memory_cache.clear()
+        assert cache.get_or_miss("benchmark disk hit") is not cache.CACHE_MISS
+    return get_or_miss
+
+
+@benchmark("cache.get_or_miss.miss", iterations=5000)
+def _get_or_miss_miss():
+    def get_or_miss():
+        assert cache.get_or_miss("benchmark missing key") is cache.CACHE_MISS
+    return get_or_miss
+
+
+@benchmark("cache.store_version_to_cache", iterations=2000)
+def _store_version_to_cache():
+    versions = iter(range(10 ** 9))
+
+    def store_version_to_cache():
+        cache.store_version_to_cache("benchmark versioned key", next(versions), fake_llm.FAKE_TABLE,
+                                     cache.PAGE_NAMESPACE)
+    return store_version_to_cache
+
+
+@benchmark("cache.resolve_similar_prompt.similar", iterations=2000)
+def _resolve_similar_prompt():
+    cache.resolve_similar_prompt("a page with a table of the matches from the brno league and a chart of the scores")
+
+    def resolve_similar_prompt():
+        cache.resolve_similar_prompt("A page with a table of the matches from the Brno league and a chart of scores!")
+    return resolve_similar_prompt
+
+
+@benchmark("data_provider.get_matches", iterations=2000)
+def _get_matches():
+    def get_matches_brno():
+        get_matches("brno")
+    return get_matches_brno
+
+
+@benchmark("data_provider.add_match", iterations=1000)
+def _add_match():
+    def add_match_brno():
+        add_match("brno", "Alice", 10, "Bob", 8)
+    return add_match_brno
+
+
+@benchmark("data_access.load_data_directly", iterations=2000)
+def _load_data_directly():
+    prompt = json.dumps({
+        "request": "load data",
+        "source": "matches from the brno league",
+        "format": "JSON",
+        "output_format": [{"player1": "name", "player2": "name", "score1": "1", "score2": "2"}],
+    })
+
+    def load_data():
+        assert load_data_directly(prompt) is not None
+    return load_data
+
+
+@benchmark("adk_bridge.run_root_agent.generated_page", iterations=50)
+def _run_root_agent_generated_page():
+    # the cache_decision_agent answers LIVE, so each iteration runs all the agents
+    async def run_root_agent():
+        styling_instructions = _resolved_future(fake_llm.RESPONSES["style_extraction_agent"])
+        await adk_bridge.run_root_agent("benchmark_user", "a page with the matches", styling_instructions,
+                                        "a page with the matches")
+    return run_root_agent
+
+
+@benchmark("adk_bridge.run_root_agent.cached_component", iterations=1000)
+def _run_root_agent_cached_component():
+    prompt = str({"id": "component_1_1", "prompt": "a table of matches"})
+
+    async def run_root_agent():
+        styling_instructions = _resolved_future(fake_llm.RESPONSES["style_extraction_agent"])
+        await adk_bridge.run_root_agent("benchmark_user", prompt, styling_instructions, "a page with the matches")
+    return run_root_agent
+
+
+def run_benchmark(benchmark_to_run: Benchmark, iterations_scale: float) -> dict:
+    measured = benchmark_to_run.setup()
+    iterations = max(int(benchmark_to_run.iterations * iterations_scale), 1)
+    warmup_iterations = min(10, max(iterations // 10, 1))
+
+    if inspect.iscoroutinefunction(measured):
+        async def measure_async():
+            for _ in range(warmup_iterations):
+                await measured()
+            durations = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await measured()
+                durations.append(time.perf_counter() - start)
+            return durations
+        durations = asyncio.run(measure_async())
+    else:
+        for _ in range(warmup_iterations):
+            measured()
+        durations = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            measured()
+            durations.append(time.perf_counter() - start)
+
+    durations.sort()
+    mean = statistics.fmean(durations)
+    return {
+        "name": benchmark_to_run.name,
+        "iterations": iterations,
+        "mean_seconds": mean,
+        "median_seconds": statistics.median(durations),
+        "min_seconds": durations[0],
+        "max_seconds": durations[-1],
+        "p95_seconds": durations[min(int(len(durations) * 0.95), len(durations) - 1)],
+        "stdev_seconds": statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        "ops_per_second": 1 / mean if mean else None,
+    }
+
+
+def _metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm_delay_seconds": fake_llm.DELAY,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the offline micro-benchmarks of mawa.")
+    parser.add_argument("--output", help="The file to write the JSON results to, the standard output by default.")
+    parser.add_argument("--filter", default="", help="Runs only the benchmarks whose name contains this text.")
+    parser.add_argument("--iterations-scale", type=float, default=1.0,
+                        help="Multiplies the number of the iterations of each benchmark, e.g. 0.1 for a quick run.")
+    args = parser.parse_args()
+
+    results = []
+    for benchmark_to_run in BENCHMARKS:
+        if args.filter not in benchmark_to_run.name:
+            continue
+        result = run_benchmark(benchmark_to_run, args.iterations_scale)
+        print(f"{result['name']}: {result['median_seconds'] * 1000:.3f} ms median", file=sys.stderr)
+        results.append(result)
+
+    report = json.dumps({"metadata": _metadata(), "benchmarks": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# the configuration of mawa is read when it is imported, so it has to point to the scratch files first
+_scratch_dir = tempfile.mkdtemp(prefix="mawa-tests-")
+os.environ["CACHE_DIR"] = os.path.join(_scratch_dir, "cache")
+os.environ["MATCHES_DATABASE_FILE"] = os.path.join(_scratch_dir, "matches.sqlite3")
+os.environ["DATA_PROVIDER_TRANSPORT"] = "in_process"
+# the tests never call the models, the client only needs some key to be created
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
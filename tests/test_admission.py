@@ -0,0 +1,152 @@
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+from mawa import admission
+from mawa.admission import BACKGROUND_PRIORITY, INTERACTIVE_PRIORITY, LOAD_PRIORITY, AdmissionControlledLlm, \
+    ModelOverloaded, _ModelSlots, request_priority
+from mawa.metrics import render_metrics
+
+
+@pytest.fixture(autouse=True)
+def model_slots(monkeypatch):
+    monkeypatch.setattr(admission, "_model_slots", {})
+    monkeypatch.setattr(admission, "MODEL_QUEUE_SIZE", 64)
+    monkeypatch.setattr(admission, "MODEL_QUEUE_TIMEOUT", 5)
+
+
+def test_the_free_slot_goes_to_the_waiter_with_the_highest_priority():
+    async def main():
+        slots = _ModelSlots("test-model", 1)
+        admitted = []
+
+        async def call(name, priority):
+            await slots.acquire(priority)
+            admitted.append(name)
+            await asyncio.sleep(0)
+            slots.release()
+
+        await slots.acquire(LOAD_PRIORITY)
+        calls = [
+            asyncio.create_task(call("background", BACKGROUND_PRIORITY)),
+            asyncio.create_task(call("first load", LOAD_PRIORITY)),
+            asyncio.create_task(call("edit", INTERACTIVE_PRIORITY)),
+            asyncio.create_task(call("second load", LOAD_PRIORITY)),
+        ]
+        await asyncio.sleep(0)
+        assert slots.waiting == 4
+        slots.release()
+        await asyncio.gather(*calls)
+        return admitted, slots.in_use
+
+    admitted, in_use = asyncio.run(main())
+    assert admitted == ["edit", "first load", "second load", "background"]
+    assert in_use == 0
+
+
+def test_the_calls_beyond_the_queue_size_are_rejected(monkeypatch):
+    monkeypatch.setattr(admission, "MODEL_QUEUE_SIZE", 1)
+
+    async def main():
+        slots = _ModelSlots("test-queue-model", 1)
+        await slots.acquire(LOAD_PRIORITY)
+        waiting = asyncio.create_task(slots.acquire(LOAD_PRIORITY))
+        await asyncio.sleep(0)
+        with pytest.raises(ModelOverloaded):
+            await slots.acquire(BACKGROUND_PRIORITY)
+        slots.release()
+        await waiting
+        return slots.in_use, slots.waiting
+
+    assert asyncio.run(main()) == (1, 0)
+    assert 'mawa_model_calls_rejected_total{model="test-queue-model",priority="background"} 1' in render_metrics()
+
+
+def test_the_calls_waiting_too_long_are_rejected(monkeypatch):
+    monkeypatch.setattr(admission, "MODEL_QUEUE_TIMEOUT", 0.01)
+
+    async def main():
+        slots = _ModelSlots("test-timeout-model", 1)
+        await slots.acquire(LOAD_PRIORITY)
+        with pytest.raises(ModelOverloaded):
+            await slots.acquire(LOAD_PRIORITY)
+        return slots.in_use, slots.waiting
+
+    assert asyncio.run(main()) == (1, 0)
+
+
+def test_a_cancelled_waiter_gives_up_its_place():
+    async def main():
+        slots = _ModelSlots("test-cancel-model", 1)
+        await slots.acquire(LOAD_PRIORITY)
+        cancelled = asyncio.create_task(slots.acquire(INTERACTIVE_PRIORITY))
+        waiting = asyncio.create_task(slots.acquire(BACKGROUND_PRIORITY))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        slots.release()
+        await waiting
+        return slots.in_use, slots.waiting
+
+    assert asyncio.run(main()) == (1, 0)
+
+
+class _StreamingLlm(BaseLlm):
+    """Streams two partial responses and the complete one, then waits until it is closed."""
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        for partial in [True, True, False]:
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text="text")]), partial=partial)
+        await asyncio.sleep(10)
+
+
+class _AdmissionControlledStreamingLlm(AdmissionControlledLlm, _StreamingLlm):
+    pass
+
+
+def test_the_slot_is_released_once_the_complete_response_arrives(monkeypatch):
+    monkeypatch.setattr(admission, "MODEL_CONCURRENCY", {"test-llm": 1})
+
+    async def main():
+        llm = _AdmissionControlledStreamingLlm(model="test-llm")
+        slots_in_use = []
+        request_priority.set(INTERACTIVE_PRIORITY)
+        responses = llm.generate_content_async(LlmRequest(model="test-llm"), stream=True)
+        async for response in responses:
+            slots_in_use.append(admission._get_model_slots("test-llm").in_use)
+            if not response.partial:
+                break
+        # the generator is still open, e.g. ADK has not closed it yet
+        slots_in_use.append(admission._get_model_slots("test-llm").in_use)
+        await responses.aclose()
+        return slots_in_use
+
+    assert asyncio.run(main()) == [1, 1, 0, 0]
+
+
+def test_the_models_without_a_limit_are_not_controlled(monkeypatch):
+    monkeypatch.setattr(admission, "DEFAULT_MODEL_CONCURRENCY", 0)
+
+    async def main():
+        llm = _AdmissionControlledStreamingLlm(model="test-unlimited-llm")
+        responses = llm.generate_content_async(LlmRequest(model="test-unlimited-llm"), stream=True)
+        async for response in responses:
+            if not response.partial:
+                break
+        await responses.aclose()
+
+    asyncio.run(main())
+    assert admission._model_slots == {"test-unlimited-llm": None}
+
+
+def test_a_rejected_call_is_answered_by_503():
+    from mawa.main import handle_overloaded_model
+
+    response = asyncio.run(handle_overloaded_model(None, ModelOverloaded("test-model is overloaded")))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
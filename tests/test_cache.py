@@ -0,0 +1,50 @@
+from mawa import cache
+from mawa.cache import CACHE_MISS, USER_NAMESPACE, clear_from_cache, get_from_cache, get_version_or_miss, \
+    resolve_similar_prompt, store_to_cache, store_user_version_to_cache
+from mawa.similarity import band_keys, minhash_signature, normalize_prompt
+
+
+def _buckets(prompt: str) -> list[str]:
+    return [f"similar prompts {band_key}" for band_key in band_keys(minhash_signature(normalize_prompt(prompt)))]
+
+
+def test_similar_prompts_resolve_to_the_prompt_seen_first():
+    assert resolve_similar_prompt("a page with the matches of the brno league") == \
+        "a page with the matches of the brno league"
+
+    assert resolve_similar_prompt("A page with  the matches of the Brno league!") == \
+        "a page with the matches of the brno league"
+    assert resolve_similar_prompt("a page with the matches of the brno leagues") == \
+        "a page with the matches of the brno league"
+    assert resolve_similar_prompt("a chart of the scores of the hradec league") == \
+        "a chart of the scores of the hradec league"
+
+
+def test_the_similar_prompt_is_found_by_the_buckets_once_its_normalized_prompt_is_evicted():
+    resolve_similar_prompt("a calming page with a table of the players")
+    clear_from_cache(f"normalized prompt {normalize_prompt('a calming page with a table of the players')}")
+
+    assert resolve_similar_prompt("a calming page with a table of the players!!") == \
+        "a calming page with a table of the players"
+
+
+def test_the_bucket_entries_without_a_signature_are_skipped_and_removed():
+    prompt = "a page with the leaderboard of the ostrava league"
+    for bucket in _buckets(prompt):
+        # the prompt was stored without its signature, which has been evicted since
+        store_to_cache(bucket, ["a page with the leaderboard of the ostrava league "])
+
+    assert resolve_similar_prompt(prompt) == prompt
+    assert all(get_from_cache(bucket) == [[prompt, list(minhash_signature(normalize_prompt(prompt)))]]
+               for bucket in _buckets(prompt))
+    assert resolve_similar_prompt("A page with the leaderboard of the Ostrava league.") == prompt
+
+
+def test_the_values_describing_a_user_are_accounted_to_their_quota(monkeypatch):
+    monkeypatch.setattr(cache, "USER_CACHE_QUOTA", 40)
+    store_user_version_to_cache("quota user", "edited components", "1", ["component_1", "component_2"],
+                                USER_NAMESPACE)
+    store_user_version_to_cache("quota user", "edited component", "1", "<div>a table</div>", USER_NAMESPACE)
+
+    assert get_version_or_miss("edited components", "1", USER_NAMESPACE) is CACHE_MISS
+    assert get_version_or_miss("edited component", "1", USER_NAMESPACE) == "<div>a table</div>"
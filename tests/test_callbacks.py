@@ -0,0 +1,69 @@
+import itertools
+
+import pytest
+from google.adk.models import LlmResponse
+from google.genai import types
+
+from mawa import callbacks
+from mawa.callbacks import StreamingResponseCleaner, clean_response_parts, filter_component_keys
+
+RESPONSES = [
+    "```html\n<div>a table</div>\n```",
+    "  ```json\n{\"status\": \"success\"}\n```  \n",
+    "<div>no code block</div>",
+    "```html<p>`inline` code and ``` in the middle</p>``` ",
+    "```",
+    "   ",
+]
+
+
+def _cleaned(text: str) -> str:
+    response = LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+    return clean_response_parts(response).content.parts[0].text
+
+
+def _streamed(chunks: list[str]) -> str:
+    cleaner = StreamingResponseCleaner()
+    return "".join(cleaner.feed(chunk) for chunk in chunks) + cleaner.flush()
+
+
+@pytest.mark.parametrize("text", RESPONSES)
+def test_streaming_cleaner_cleans_as_clean_response_parts_at_any_chunk_boundary(text):
+    for first, second in itertools.combinations(range(len(text) + 1), 2):
+        chunks = [text[:first], text[first:second], text[second:]]
+        assert _streamed(chunks) == _cleaned(text), chunks
+
+
+def test_streaming_cleaner_holds_back_only_a_possible_delimiter():
+    cleaner = StreamingResponseCleaner()
+
+    assert cleaner.feed("```ht") == ""
+    assert cleaner.feed("ml\n<div>") == "\n<div>"
+    assert cleaner.feed("</div>\n``") == "</div>"
+    assert cleaner.feed("`") == ""
+    assert cleaner.flush() == "\n"
+
+
+def test_filter_component_keys_injects_the_most_recently_stored_components(monkeypatch):
+    monkeypatch.setattr(callbacks, "MAX_INJECTED_COMPONENT_PROMPTS_SIZE", 40)
+    state = {
+        "user:component_1": "a table",
+        "user:stored_at:component_1": 30.0,
+        "user:component_2": "a chart",
+        "user:stored_at:component_2": 10.0,
+        "user:component_3": "a form",
+        "user:stored_at:component_3": 20.0,
+        "root_prompt": "a page",
+    }
+
+    assert filter_component_keys(state) == (
+        '[{"componentId": "component_3", "bodyValue": "a form"}, '
+        '{"componentId": "component_1", "bodyValue": "a table"}]')
+
+
+def test_filter_component_keys_keeps_the_state_order_without_store_times():
+    state = {"user:component_1": "a table", "user:component_2": "a chart"}
+
+    assert filter_component_keys(state) == (
+        '[{"componentId": "component_1", "bodyValue": "a table"}, '
+        '{"componentId": "component_2", "bodyValue": "a chart"}]')
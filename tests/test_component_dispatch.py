@@ -0,0 +1,86 @@
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from mawa.component_dispatch import ComponentDispatcher
+from mawa.constants import NO_CONTENT
+from mawa.request_classifier import ADD_DATA_AGENT, CHART_DATA_VISUALIZATION_AGENT, TABULAR_DATA_VISUALIZATION_AGENT
+
+APP_NAME = "test app"
+
+
+class _OutputAgent(BaseAgent):
+    """Stores its name to its output_key in two events, as the visualization agents store their outputs."""
+
+    output_key: str
+    error: bool = False
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        for text in ["generating", self.name]:
+            await asyncio.sleep(0.01)
+            if self.error:
+                raise RuntimeError(f"{self.name} has failed")
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                content=types.Content(role="model", parts=[types.Part(text=text)]),
+                actions=EventActions(state_delta={self.output_key: text}),
+            )
+
+
+def _dispatcher(failing_agent: str = None) -> ComponentDispatcher:
+    return ComponentDispatcher(name="component_parallel_sub_agents", sub_agents=[
+        _OutputAgent(name=name, output_key=f"{name}_output", error=name == failing_agent)
+        for name in [TABULAR_DATA_VISUALIZATION_AGENT, CHART_DATA_VISUALIZATION_AGENT, ADD_DATA_AGENT]
+    ])
+
+
+async def _run(dispatcher: ComponentDispatcher, prompt: str) -> tuple[list[Event], dict]:
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name=APP_NAME, user_id="user")
+    runner = Runner(agent=dispatcher, app_name=APP_NAME, session_service=session_service)
+    events = [event async for event in runner.run_async(
+        user_id="user", session_id=session.id, new_message=types.Content(role="user", parts=[types.Part(text=prompt)]))]
+    session = await session_service.get_session(app_name=APP_NAME, user_id="user", session_id=session.id)
+    return events, session.state
+
+
+def test_only_the_sub_agents_the_prompt_needs_run_and_the_others_output_no_content():
+    events, state = asyncio.run(_run(_dispatcher(), str({"id": "component_1_1", "prompt": "a table of matches"})))
+
+    assert [event.author for event in events if event.content] == [TABULAR_DATA_VISUALIZATION_AGENT] * 2
+    assert state == {
+        f"{TABULAR_DATA_VISUALIZATION_AGENT}_output": TABULAR_DATA_VISUALIZATION_AGENT,
+        f"{CHART_DATA_VISUALIZATION_AGENT}_output": NO_CONTENT,
+        f"{ADD_DATA_AGENT}_output": NO_CONTENT,
+    }
+
+
+def test_each_sub_agent_runs_in_its_own_branch():
+    events, _ = asyncio.run(_run(_dispatcher(), "a chart of the scores with a form to add a new match"))
+
+    assert {(event.author, event.branch) for event in events if event.content} == {
+        (CHART_DATA_VISUALIZATION_AGENT, f"component_parallel_sub_agents.{CHART_DATA_VISUALIZATION_AGENT}"),
+        (ADD_DATA_AGENT, f"component_parallel_sub_agents.{ADD_DATA_AGENT}"),
+    }
+
+
+def test_all_the_sub_agents_run_for_an_unknown_prompt():
+    events, state = asyncio.run(_run(_dispatcher(), "a fun fact"))
+
+    assert sorted(event.author for event in events if event.content) == sorted(
+        [TABULAR_DATA_VISUALIZATION_AGENT, CHART_DATA_VISUALIZATION_AGENT, ADD_DATA_AGENT] * 2)
+    assert NO_CONTENT not in state.values()
+
+
+def test_the_failure_of_a_sub_agent_is_raised():
+    with pytest.raises(RuntimeError, match=CHART_DATA_VISUALIZATION_AGENT):
+        asyncio.run(_run(_dispatcher(failing_agent=CHART_DATA_VISUALIZATION_AGENT), "a fun fact"))
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from mawa.data_access import load_data_directly, save_match_directly
+from mawa_mcp_server import data_provider
+
+
+@pytest.fixture(autouse=True)
+def matches_database(tmp_path, monkeypatch):
+    # a fresh database with the mock data
+    monkeypatch.setattr(data_provider, "DATA_FILE", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(data_provider, "DATABASE_FILE", str(tmp_path / "matches.sqlite3"))
+
+
+def _load_data(output_format, source="the matches of the brno league", **request) -> list[dict] | None:
+    loaded_data = load_data_directly(json.dumps({
+        "request": "load data",
+        "source": source,
+        "format": "JSON",
+        "output_format": output_format,
+        **request,
+    }))
+    return None if loaded_data is None else json.loads(loaded_data)
+
+
+def test_load_data_projects_the_matches_of_the_league_in_the_source():
+    matches = _load_data([{"player1Name": "name", "player1Score": 1, "player_2": "name", "score2": 2}])
+
+    assert matches == [
+        {"player1Name": "Jahodovy Knedlik", "player1Score": 15, "player_2": "Nakladany Hermelin", "score2": 10},
+        {"player1Name": "Tom", "player1Score": 0, "player_2": "Hovezi Gulas", "score2": 9},
+        {"player1Name": "Tom", "player1Score": 1, "player_2": "Nakladany Hermelin", "score2": 9},
+    ]
+
+
+def test_load_data_takes_the_league_property_first():
+    matches = _load_data([{"home": "name", "away": "name"}], source="matches_database", league="Hradec")
+
+    assert matches == [{"home": "Rizek", "away": "Kachna"}, {"home": "Salam", "away": "Kachna"}]
+
+
+def test_load_data_maps_the_player_names_by_the_digits_of_the_examples():
+    matches = _load_data([{"name": "userName1", "opponent name": "userName2", "score": "player1_score"}])
+
+    assert matches[0] == {"name": "Jahodovy Knedlik", "opponent name": "Nakladany Hermelin", "score": 15}
+
+
+def test_load_data_leaves_the_requests_without_a_league_to_the_agent():
+    assert _load_data([{"player1": "name", "player2": "name"}], source="matches_database") is None
+
+
+@pytest.mark.parametrize("output_format", [
+    # which player scored 3?
+    [{"player1": "name", "player2": "name", "score": "3-1"}],
+    [{"score": 10}],
+    [{"winner": "name"}],
+    [],
+    "player1, player2",
+])
+def test_load_data_leaves_the_ambiguous_output_formats_to_the_agent(output_format):
+    assert _load_data(output_format) is None
+
+
+def test_load_data_leaves_the_other_formats_to_the_agent():
+    assert _load_data([{"player1": "name"}], format="CSV") is None
+
+
+def test_save_match_stores_the_match_with_the_coerced_types():
+    result = save_match_directly('create a new match: {"league": "Brno", "player1": "Tom", "player1Score": "10", '
+                                 '"player2": "Rizek", "player2_score": 8.0}')
+
+    assert json.loads(result) == {"status": "success"}
+    assert data_provider.get_matches("brno")["users"][-1] | {"id": None} == {
+        "id": None, "player1": "Tom", "player1_score": 10, "player2": "Rizek", "player2_score": 8}
+
+
+@pytest.mark.parametrize("payload, message", [
+    ({"league": "Brno", "player1": "Tom", "player1_score": "ten", "player2": "Rizek", "player2_score": 8},
+     "invalid value of 'player1_score'"),
+    ({"league": "Brno", "player1": "Tom", "player1_score": 10, "player2_score": 8}, "missing 'player2'"),
+    ({"league": "Olomouc", "player1": "Tom", "player1_score": 10, "player2": "Rizek", "player2_score": 8},
+     "No league information"),
+])
+def test_save_match_reports_the_invalid_matches(payload, message):
+    result = json.loads(save_match_directly(f"create a new match: {json.dumps(payload)}"))
+
+    assert result["status"] == "error"
+    assert message in result["message"]
+    assert len(data_provider.get_matches("brno")["users"]) == 3
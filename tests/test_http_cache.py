@@ -0,0 +1,76 @@
+import gzip
+
+import pytest
+from starlette.requests import Request
+
+from mawa.http_cache import GENERATED_CACHE_CONTROL, cached_response
+
+BODY = "<div>" + "a generated page " * 100 + "</div>"
+SHORT_BODY = "<div>a component</div>"
+
+
+def _request(method="GET", **headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": method,
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def _etag(body=BODY, **headers) -> str:
+    return cached_response(_request(**headers), body, "text/html", GENERATED_CACHE_CONTROL).headers["etag"]
+
+
+def test_the_body_is_sent_gzipped_if_accepted():
+    response = cached_response(_request(accept_encoding="br, gzip"), BODY, "text/html", GENERATED_CACHE_CONTROL)
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == GENERATED_CACHE_CONTROL
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body).decode() == BODY
+
+
+@pytest.mark.parametrize("headers, body", [
+    ({}, BODY),
+    ({"accept_encoding": "gzip;q=0, identity"}, BODY),
+    ({"accept_encoding": "gzip"}, SHORT_BODY),
+])
+def test_the_body_is_sent_as_it_is_otherwise(headers, body):
+    response = cached_response(_request(**headers), body, "text/html", GENERATED_CACHE_CONTROL)
+
+    assert "content-encoding" not in response.headers
+    assert response.body.decode() == body
+
+
+def test_the_gzipped_body_has_its_own_strong_etag():
+    identity_etag = _etag()
+    gzip_etag = _etag(accept_encoding="gzip")
+
+    assert identity_etag.startswith('"') and not identity_etag.startswith('W/')
+    assert gzip_etag == identity_etag[:-1] + '-gzip"'
+    assert _etag(body=BODY + " ") != identity_etag
+
+
+@pytest.mark.parametrize("accept_encoding", ["", "gzip"])
+@pytest.mark.parametrize("representation", ["identity", "gzip"])
+def test_304_is_answered_for_either_representation_of_the_body(accept_encoding, representation):
+    etag = _etag(accept_encoding="gzip") if representation == "gzip" else _etag()
+
+    response = cached_response(_request(if_none_match=f'"other", W/{etag}', accept_encoding=accept_encoding), BODY,
+                               "text/html", GENERATED_CACHE_CONTROL)
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.body == b""
+
+
+@pytest.mark.parametrize("request_to_send", [
+    _request(if_none_match='"other"'),
+    _request(method="POST", if_none_match="*"),
+])
+def test_the_body_is_sent_if_the_browser_does_not_have_it(request_to_send):
+    response = cached_response(request_to_send, BODY, "text/html", GENERATED_CACHE_CONTROL)
+
+    assert response.status_code == 200
+    assert response.body.decode() == BODY
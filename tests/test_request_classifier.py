@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from mawa.request_classifier import ADD_DATA_AGENT, CACHE, CHART_DATA_VISUALIZATION_AGENT, COMPONENT_PAGE_AGENT, \
+    DATA_LOADER_AGENT, DATA_SAVER_AGENT, LIVE, TABULAR_DATA_VISUALIZATION_AGENT, RequestClassification, \
+    classify_request, select_component_agents
+
+
+@pytest.mark.parametrize("prompt, classification", [
+    (str({"id": "component_1_1", "prompt": "a table of the matches"}),
+     RequestClassification(CACHE, COMPONENT_PAGE_AGENT)),
+    (json.dumps({"id": "component_1_1", "prompt": "a table of the matches"}),
+     RequestClassification(CACHE, COMPONENT_PAGE_AGENT)),
+    (json.dumps({"request": "load data", "source": "matches", "format": "JSON"}),
+     RequestClassification(LIVE, DATA_LOADER_AGENT)),
+    ('create a new match: {"league": "brno", "player1": "Tom"}', RequestClassification(LIVE, DATA_SAVER_AGENT)),
+    ('  Create a new match {"league": "brno"}', RequestClassification(LIVE, DATA_SAVER_AGENT)),
+])
+def test_classify_request_recognizes_the_requests_of_the_generated_pages(prompt, classification):
+    assert classify_request(prompt) == classification
+
+
+@pytest.mark.parametrize("prompt", [
+    "a page with the matches of the brno league",
+    str({"id": "component_1_1", "prompt": "a live table of the matches"}),
+    str({"id": "component_1_1", "prompt": "a table of the matches, do not cache it"}),
+    json.dumps({"request": "delete data"}),
+    "[1, 2, 3]",
+    "create a new match please",
+])
+def test_classify_request_leaves_the_other_prompts_to_the_agents(prompt):
+    assert classify_request(prompt) is None
+
+
+@pytest.mark.parametrize("prompt, agents", [
+    ("a table of the matches", [TABULAR_DATA_VISUALIZATION_AGENT]),
+    ("the leaderboard of the league", [TABULAR_DATA_VISUALIZATION_AGENT]),
+    ("a pie chart of the scores", [CHART_DATA_VISUALIZATION_AGENT]),
+    ("a form to add a new match", [ADD_DATA_AGENT]),
+    ("a table of the matches with a form to add a new match", [TABULAR_DATA_VISUALIZATION_AGENT, ADD_DATA_AGENT]),
+    (str({"id": "component_1_1", "prompt": "a chart and a table of the scores"}),
+     [TABULAR_DATA_VISUALIZATION_AGENT, CHART_DATA_VISUALIZATION_AGENT]),
+])
+def test_select_component_agents(prompt, agents):
+    assert select_component_agents(prompt) == agents
+
+
+@pytest.mark.parametrize("prompt", ["a fun fact about table football", "a welcome message"])
+def test_select_component_agents_lets_all_the_agents_decide_on_unknown_prompts(prompt):
+    assert select_component_agents(prompt) is None
@@ -0,0 +1,100 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+import pytest
+from google.adk.sessions import InMemorySessionService
+
+from mawa import sessions
+from mawa.sessions import EphemeralSessions, TooManySessions
+
+APP_NAME = "test app"
+
+
+@pytest.fixture(autouse=True)
+def session_limits(monkeypatch):
+    monkeypatch.setattr(sessions, "MAX_LIVE_SESSIONS", 2)
+    monkeypatch.setattr(sessions, "SESSION_TTL", 900)
+
+
+async def _get_session(ephemeral_sessions, user_id, session_id):
+    return await ephemeral_sessions.session_service.get_session(app_name=APP_NAME, user_id=user_id,
+                                                                session_id=session_id)
+
+
+def test_the_session_is_deleted_once_the_request_is_done_and_the_user_state_is_kept():
+    async def main():
+        ephemeral_sessions = EphemeralSessions(InMemorySessionService(), APP_NAME)
+        async with ephemeral_sessions.session("user", {"user:component_1": "a table", "root_prompt": "a page"}) \
+                as session:
+            assert session.state["root_prompt"] == "a page"
+        deleted_session = await _get_session(ephemeral_sessions, "user", session.id)
+        async with ephemeral_sessions.session("user") as next_session:
+            return deleted_session, next_session.state, ephemeral_sessions.metrics()
+
+    deleted_session, next_state, metrics = asyncio.run(main())
+    assert deleted_session is None
+    assert next_state == {"user:component_1": "a table"}
+    assert metrics == {"live": 1, "created": 2, "deleted": 1, "expired": 0, "rejected": 0}
+
+
+def test_the_sessions_in_flight_are_never_deleted_to_make_room():
+    async def main():
+        ephemeral_sessions = EphemeralSessions(InMemorySessionService(), APP_NAME)
+        async with AsyncExitStack() as requests:
+            live_sessions = [await requests.enter_async_context(ephemeral_sessions.session(f"user {i}"))
+                             for i in range(2)]
+            with pytest.raises(TooManySessions):
+                await requests.enter_async_context(ephemeral_sessions.session("user 2"))
+            still_live = [await _get_session(ephemeral_sessions, session.user_id, session.id)
+                          for session in live_sessions]
+        # the finished requests make room again
+        async with ephemeral_sessions.session("user 2"):
+            pass
+        return still_live, ephemeral_sessions.metrics()
+
+    still_live, metrics = asyncio.run(main())
+    assert all(session is not None for session in still_live)
+    assert metrics == {"live": 0, "created": 3, "deleted": 3, "expired": 0, "rejected": 1}
+
+
+def test_the_sessions_past_the_ttl_are_deleted(monkeypatch):
+    async def main():
+        ephemeral_sessions = EphemeralSessions(InMemorySessionService(), APP_NAME)
+        async with ephemeral_sessions.session("stuck user") as stuck_session:
+            monkeypatch.setattr(sessions, "SESSION_TTL", 0)
+            async with ephemeral_sessions.session("user"):
+                expired_session = await _get_session(ephemeral_sessions, "stuck user", stuck_session.id)
+        return expired_session, ephemeral_sessions.metrics()
+
+    expired_session, metrics = asyncio.run(main())
+    assert expired_session is None
+    assert metrics == {"live": 0, "created": 2, "deleted": 1, "expired": 1, "rejected": 0}
+
+
+def test_the_state_of_the_least_recently_active_users_is_deleted_past_the_size_limit(monkeypatch):
+    monkeypatch.setattr(sessions, "MAX_USER_STATE_SIZE", 60)
+
+    async def main():
+        session_service = InMemorySessionService()
+        ephemeral_sessions = EphemeralSessions(session_service, APP_NAME)
+        for user_id in ["user 1", "user 2", "user 1", "user 3"]:
+            async with ephemeral_sessions.session(user_id, {"user:component_1": f"a table of {user_id}"}):
+                pass
+        return session_service, ephemeral_sessions.user_state_metrics()
+
+    session_service, metrics = asyncio.run(main())
+    assert session_service.user_state[APP_NAME] == {
+        "user 1": {"component_1": "a table of user 1"},
+        "user 3": {"component_1": "a table of user 3"},
+    }
+    assert session_service.sessions[APP_NAME] == {}
+    assert metrics == {"users": 2, "bytes": 56, "evicted": 1}
+
+
+def test_a_request_without_a_session_is_answered_by_503():
+    from mawa.main import handle_too_many_sessions
+
+    response = asyncio.run(handle_too_many_sessions(None, TooManySessions("all the sessions are in use")))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from mawa import single_flight as single_flight_module
+from mawa.single_flight import SingleFlightCancelled, single_flight, single_flight_stream
+
+
+class GenerationFailed(Exception):
+    pass
+
+
+def test_single_flight_shares_the_result_of_the_leader():
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "the page"
+
+    async def main():
+        return await asyncio.gather(*(single_flight("key", generate) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["the page"] * 5
+    assert len(calls) == 1
+
+
+def test_single_flight_raises_the_error_of_the_leader_to_the_followers():
+    async def generate():
+        await asyncio.sleep(0.01)
+        raise GenerationFailed("the model has failed")
+
+    async def main():
+        return await asyncio.gather(*(single_flight("key", generate) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, GenerationFailed) for error in errors)
+    assert errors[0] is errors[1] is errors[2]
+
+
+def test_single_flight_goes_on_for_the_followers_of_a_cancelled_leader():
+    async def generate():
+        await asyncio.sleep(0.01)
+        return "the page"
+
+    async def main():
+        leader = asyncio.create_task(single_flight("key", generate))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(single_flight("key", generate))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "the page"
+
+
+def test_single_flight_raises_cancelled_to_the_followers_of_a_cancelled_generation():
+    async def generate():
+        await asyncio.sleep(10)
+
+    async def main():
+        follower = asyncio.create_task(single_flight("key", generate))
+        await asyncio.sleep(0)
+        for generation in single_flight_module._generations:
+            generation.cancel()
+        await follower
+
+    with pytest.raises(SingleFlightCancelled):
+        asyncio.run(main())
+
+
+def test_single_flight_starts_a_new_generation_once_the_previous_one_has_failed():
+    results = iter([GenerationFailed("the first one fails"), "the page"])
+
+    async def generate():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def main():
+        with pytest.raises(GenerationFailed):
+            await single_flight("key", generate)
+        return await single_flight("key", generate)
+
+    assert asyncio.run(main()) == "the page"
+
+
+def test_single_flight_stream_streams_to_the_leader_and_joins_for_the_followers():
+    async def generate():
+        for chunk in ["<div>", "the page", "</div>"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in single_flight_stream("key", generate)]
+
+    async def main():
+        return await asyncio.gather(collect(), collect())
+
+    leader_chunks, follower_chunks = asyncio.run(main())
+    assert leader_chunks == ["<div>", "the page", "</div>"]
+    assert follower_chunks == ["<div>the page</div>"]
+
+
+def test_single_flight_stream_raises_the_error_of_the_leader_to_the_followers():
+    async def generate():
+        yield "<div>"
+        await asyncio.sleep(0.01)
+        raise GenerationFailed("the model has failed")
+
+    async def collect():
+        return [chunk async for chunk in single_flight_stream("key", generate)]
+
+    async def main():
+        return await asyncio.gather(collect(), collect(), return_exceptions=True)
+
+    leader_error, follower_error = asyncio.run(main())
+    assert isinstance(leader_error, GenerationFailed)
+    assert follower_error is leader_error
+
+
+def test_single_flight_stream_goes_on_for_the_followers_once_the_leader_stops_reading():
+    async def generate():
+        for chunk in ["<div>", "the page", "</div>"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def main():
+        leader = single_flight_stream("key", generate)
+        assert await leader.__anext__() == "<div>"
+        follower = asyncio.create_task(single_flight("key", generate))
+        # e.g. the client of the leader has disconnected
+        await leader.aclose()
+        return await follower
+
+    assert asyncio.run(main()) == "<div>the page</div>"